@@ -13,10 +13,12 @@ setup(
         "pipelinewise-singer-python==1.*",
         "requests==2.25.1",
     ],
-    extras_require={"dev": ["ipdb", "pylint", "nose"]},
+    extras_require={"dev": ["ipdb", "pylint", "nose"], "parquet": ["pyarrow"]},
     entry_points="""
           [console_scripts]
           tap-xero=tap_xero:main
+          tap-xero-distributed=tap_xero.distributed:main
+          tap-xero-daemon=tap_xero.daemon:main
       """,
     packages=["tap_xero"],
     package_data={"schemas": ["tap_xero/schemas/*.json"]},
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import os
+import json
+from contextlib import nullcontext
+from functools import lru_cache
 import singer
 from singer import metadata, utils
 from singer.catalog import Catalog, CatalogEntry, Schema
@@ -10,9 +13,15 @@ from .streams import (
     sub_stream_ids,
     has_sub_stream_ids,
     sub_stream_suffix,
+    StopRun,
 )
 from .client import XeroClient
 from .context import Context
+from .planner import StreamPlanner
+from .profiling import StreamProfiler
+from . import targeted
+from . import reconcile
+from . import reference
 
 REQUIRED_CONFIG_KEYS = [
     "start_date",
@@ -34,6 +43,15 @@ def get_abs_path(path):
 
 
 def load_schema(tap_stream_id):
+    # each caller gets its own copy, as the singer Transformer modifies the
+    # schemas it's given
+    return json.loads(_resolved_schema(tap_stream_id))
+
+
+# The schemas are read and resolved once per process, which a daemon's later
+# runs save on
+@lru_cache(maxsize=None)
+def _resolved_schema(tap_stream_id):
     path = "schemas/{}.json".format(tap_stream_id)
     schema = utils.load_json(get_abs_path(path))
     dependencies = schema.pop("tap_schema_dependencies", [])
@@ -42,7 +60,7 @@ def load_schema(tap_stream_id):
         refs[sub_stream_id] = load_schema(sub_stream_id)
     if refs:
         singer.resolve_schema_references(schema, refs)
-    return schema
+    return json.dumps(schema)
 
 
 def load_metadata(stream, schema):
@@ -75,19 +93,33 @@ def ensure_credentials_are_valid(config):
     XeroClient(config).fetch("currencies")
 
 
-def load_correct_schema(stream_id):
-    return (
+def load_correct_schema(stream_id, config=None):
+    schema = (
         load_schema(stream_id)
         if not stream_id.endswith(sub_stream_suffix) or "journals" in stream_id
         else load_schema("line_items")
     )
+    # the fields enrichment fills in are only advertised when it's on
+    enrich = config and config.get("enrich_line_items")
+    if enrich and stream_id in reference.ENRICHED_STREAMS:
+        schema = reference.enriched_schema(schema)
+    return schema
+
+
+def load_json(path, default=None):
+    """The JSON file at path, or default if there's no path or no such file
+    yet, as for a state file before the first run."""
+    if not path or not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
 
 
 def discover(ctx):
     ctx.refresh_credentials()
     catalog = Catalog([])
     for stream in streams.all_streams:
-        schema_dict = load_correct_schema(stream.tap_stream_id)
+        schema_dict = load_correct_schema(stream.tap_stream_id, ctx.config)
         mdata = load_metadata(stream, schema_dict)
 
         schema = Schema.from_dict(schema_dict)
@@ -103,46 +135,133 @@ def discover(ctx):
     return catalog
 
 
-def load_and_write_schema(stream):
-    singer.write_schema(
+def load_and_write_schema(ctx, stream):
+    ctx.sink.write_schema(
         stream.tap_stream_id,
-        load_correct_schema(stream.tap_stream_id),
+        load_correct_schema(stream.tap_stream_id, ctx.config),
         stream.pk_fields,
     )
 
 
 def sync(ctx):
-    ctx.refresh_credentials()
-    stream_ids_to_sync = {
-        cs.tap_stream_id for cs in ctx.catalog.streams if cs.is_selected()
-    }
-
-    streams = [s for s in all_streams if s.tap_stream_id in stream_ids_to_sync]
-    subs_dict = {
-        s.tap_stream_id: s
-        for s in streams
-        if s.tap_stream_id in sub_stream_ids and s.tap_stream_id in stream_ids_to_sync
-    }
-    for stream in streams:
-        stream_id = stream.tap_stream_id
-
+    # the sink is closed even when the sync fails, so that output still
+    # buffered, including the checkpoint written on the way out, isn't lost
+    # with the writer thread
+    try:
+        ctx.refresh_credentials()
+        stream_ids_to_sync = {
+            cs.tap_stream_id for cs in ctx.catalog.streams if cs.is_selected()
+        }
+
+        streams = [s for s in all_streams if s.tap_stream_id in stream_ids_to_sync]
+        subs_dict = {
+            s.tap_stream_id: s
+            for s in streams
+            if s.tap_stream_id in sub_stream_ids
+            and s.tap_stream_id in stream_ids_to_sync
+        }
+        planner = StreamPlanner(ctx)
+        profiler = StreamProfiler.from_config(ctx.config)
         # sub-stream IDs will be synced by parent stream
-        if stream_id in sub_stream_ids:
-            continue
-
+        parents = [
+            s for s in planner.order(streams) if s.tap_stream_id not in sub_stream_ids
+        ]
+        for i, stream in enumerate(parents):
+            stream_id = stream.tap_stream_id
+
+            if planner.should_defer(stream_id):
+                continue
+
+            ctx.write_state()
+            load_and_write_schema(ctx, stream)
+
+            sub = (
+                subs_dict.get(stream_id + sub_stream_suffix)
+                if stream_id in has_sub_stream_ids
+                else None
+            )
+            if sub:
+                load_and_write_schema(ctx, sub)
+
+            LOGGER.info("Syncing stream: %s", stream_id)
+            try:
+                with profiler.profile(stream_id) if profiler else nullcontext():
+                    planner.run(stream, sub)
+            except StopRun as e:
+                # Hit the daily rate limit or max_runtime. The stream's offsets
+                # were checkpointed before each request, so stop cleanly and let
+                # the next run pick up from there
+                LOGGER.warning(e)
+                planner.record_usage()
+                planner.defer_rest([s.tap_stream_id for s in parents[i:]])
+                ctx.write_state()
+                break
+            ctx.sink.finish_stream(stream_id)
+            if sub:
+                ctx.sink.finish_stream(sub.tap_stream_id)
+
+        if profiler:
+            profiler.write_summary()
+    finally:
+        ctx.close()
+
+
+def sync_targeted(ctx):
+    """Refreshes only the records whose IDs were requested in config or
+    reported in the webhook event log, with their line items."""
+    try:
+        ids_by_stream, log_offset = targeted.load_refresh_ids(ctx)
+        ctx.refresh_credentials()
+        for stream_id, ids in ids_by_stream.items():
+            entry = ctx.catalog.get_stream(stream_id)
+            if not entry or not entry.is_selected():
+                LOGGER.warning("Skipping refresh of unselected stream %s", stream_id)
+                continue
+            stream = streams.streams_by_id[stream_id]
+            load_and_write_schema(ctx, stream)
+            sub_entry = ctx.catalog.get_stream(stream_id + sub_stream_suffix)
+            sub = None
+            if sub_entry and sub_entry.is_selected():
+                sub = streams.streams_by_id[sub_entry.tap_stream_id]
+                load_and_write_schema(ctx, sub)
+            LOGGER.info("Refreshing %s %s records", len(ids), stream_id)
+            try:
+                targeted.refresh_stream(ctx, stream, sub, ids)
+            except StopRun as e:
+                # Hit the daily rate limit or max_runtime. The webhook log
+                # offset isn't advanced, so the next run refreshes these
+                # records again
+                LOGGER.warning(e)
+                break
+            ctx.sink.finish_stream(stream_id)
+            if sub:
+                ctx.sink.finish_stream(sub.tap_stream_id)
+        else:
+            targeted.save_log_offset(ctx, log_offset)
         ctx.write_state()
-        load_and_write_schema(stream)
+    finally:
+        ctx.close()
 
-        sub = (
-            subs_dict.get(stream_id + sub_stream_suffix)
-            if stream_id in has_sub_stream_ids
-            else None
-        )
-        if sub:
-            load_and_write_schema(sub)
 
-        LOGGER.info("Syncing stream: %s", stream_id)
-        stream.sync(ctx, sub)
+def sync_reconcile(ctx):
+    """Reports records that have been deleted or changed status since the
+    last reconciliation, as events on their own stream."""
+    try:
+        ctx.refresh_credentials()
+        ctx.sink.write_schema(
+            reconcile.STREAM_ID,
+            load_schema(reconcile.STREAM_ID),
+            reconcile.KEY_PROPERTIES,
+        )
+        try:
+            reconcile.reconcile(ctx)
+        except StopRun as e:
+            # Hit the daily rate limit or max_runtime. The interrupted stream's
+            # index isn't saved, so the next run reconciles it again
+            LOGGER.warning(e)
+        ctx.write_state()
+    finally:
+        ctx.close()
 
 
 def main_impl():
@@ -156,7 +275,17 @@ def main_impl():
             if args.properties
             else discover(Context(args.config, {}, {}))
         )
-        sync(Context(args.config, args.state, catalog))
+        run(Context(args.config, args.state, catalog))
+
+
+def run(ctx):
+    """Runs whichever kind of sync the config asks for."""
+    if targeted.requested(ctx.config):
+        sync_targeted(ctx)
+    elif reconcile.requested(ctx.config):
+        sync_reconcile(ctx)
+    else:
+        sync(ctx)
 
 
 def main():
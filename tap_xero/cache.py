@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    """On-disk cache of raw Xero responses, addressed by a hash of the request
+    (tenant, resource, query params and If-Modified-Since). A sync resumed
+    within the TTL replays the pages the interrupted one fetched from disk
+    instead of spending API calls. In offline mode entries never expire and a
+    miss is an error, so a populated cache directory can be used as a fixture
+    source."""
+
+    def __init__(
+        self, directory, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, offline=False
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        directory = config.get("response_cache_dir")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_bytes=int(config.get("response_cache_max_bytes", DEFAULT_MAX_BYTES)),
+            ttl=float(config.get("response_cache_ttl", DEFAULT_TTL)),
+            offline=bool(config.get("response_cache_offline", False)),
+        )
+
+    @staticmethod
+    def key(tenant_id, resource, params, since):
+        request = json.dumps(
+            [tenant_id, resource, sorted(params.items()), since], default=str
+        )
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if not self.offline and age > self.ttl:
+                _remove(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read().decode("utf-8")
+        except FileNotFoundError:
+            if self.offline:
+                raise CacheMiss(f"No cached response for request {key}")
+            return None
+
+    def put(self, key, text):
+        if self.offline:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = text.encode("utf-8")
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        # Write then rename so a crash mid-write can't leave a truncated entry
+        # behind; the temporary file is unique, as other processes sharing the
+        # cache may be writing the same entry
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_mtime, st.st_size
+
+    def evict(self):
+        """Drop expired entries, then the oldest entries until the cache fits
+        within max_bytes."""
+        now = time.time()
+        live = []
+        total = 0
+        for path, mtime, size in self._entries():
+            if now - mtime > self.ttl:
+                _remove(path)
+            else:
+                live.append((mtime, size, path))
+                total += size
+        self._size = total
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(live):
+            _remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._size = total
+        LOGGER.info("Evicted response cache entries down to %s bytes", total)
+
+
+def _remove(path):
+    """Removes a cache file, which another process may have removed first."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
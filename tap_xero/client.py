@@ -1,26 +1,40 @@
 import singer
 import os
-import re
-import json
-import decimal
+import time
+import fcntl
 from os.path import join
-from datetime import datetime, date, time, timedelta
 import requests
-from singer.utils import strftime, strptime_to_utc
-import six
-import pytz
+from .cache import ResponseCache
+from .concurrency import ConcurrencyController
+# parse_date and the object hook used to live here, keep importing them from here
+from .decoding import (  # pylint: disable=unused-import
+    Decoder,
+    parse_date,
+    _json_load_object_hook,
+)
 
 BASE_URL = "https://api.xero.com/api.xro/2.0"
 
 refresh_token_path = os.path.join(os.path.dirname(__file__), "refresh_token.secret")
+# How long before an access token expires to stop reusing it
+TOKEN_EXPIRY_MARGIN = 120
 logger = singer.get_logger()
 
 
 def get_token(config):
+    """Returns an access token and the seconds it's valid for."""
+    # Refresh tokens are single use, so processes syncing in parallel have to
+    # take turns exchanging the one saved on disk
+    with open(refresh_token_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _exchange_refresh_token(config)
+
+
+def _exchange_refresh_token(config):
     # fall back to the refresh token in config on failure (which will be the first time it runs, or if it expires)
     try:
         with open(refresh_token_path) as f:
-            refresh_token = f.read().replace("\n, "")
+            refresh_token = f.read().replace("\n", "")
             # logger.info(f"refresh token is {refresh_token}")
     except:
         logger.info("falling back to config refresh token")
@@ -38,59 +52,7 @@ def get_token(config):
     with open(refresh_token_path, "w") as f:
         f.write(refresh_token)
 
-    return access_token
-
-
-def parse_date(value):
-    # Xero datetimes can be .NET JSON date strings which look like
-    # "/Date(1419937200000+0000)/"
-    # https://developer.xero.com/documentation/api/requests-and-responses
-    pattern = r"Date\((\-?\d+)([-+])?(\d+)?\)"
-    match = re.search(pattern, value)
-
-    iso8601pattern = r"((\d{4})-([0-2]\d)-0?([0-3]\d)T([0-5]\d):([0-5]\d):([0-6]\d))"
-
-    if not match:
-        iso8601match = re.search(iso8601pattern, value)
-        if iso8601match:
-            try:
-                return strptime_to_utc(value)
-            except Exception:
-                return None
-        else:
-            return None
-
-    millis_timestamp, offset_sign, offset = match.groups()
-    if offset:
-        if offset_sign == "+":
-            offset_sign = 1
-        else:
-            offset_sign = -1
-        offset_hours = offset_sign * int(offset[:2])
-        offset_minutes = offset_sign * int(offset[2:])
-    else:
-        offset_hours = 0
-        offset_minutes = 0
-
-    return datetime.utcfromtimestamp((int(millis_timestamp) / 1000)) + timedelta(
-        hours=offset_hours, minutes=offset_minutes
-    )
-
-
-def _json_load_object_hook(_dict):
-    """Hook for json.parse(...) to parse Xero date formats."""
-    # This was taken from the pyxero library and modified
-    # to format the dates according to RFC3339
-    for key, value in _dict.items():
-        if isinstance(value, six.string_types):
-            value = parse_date(value)
-            if value:
-                # NB> Pylint disabled because, regardless of idioms, this is more explicit than isinstance.
-                if type(value) is date:  # pylint: disable=unidiomatic-typecheck
-                    value = datetime.combine(value, time.min)
-                value = value.replace(tzinfo=pytz.UTC)
-                _dict[key] = strftime(value)
-    return _dict
+    return access_token, json.get("expires_in")
 
 
 class XeroClient:
@@ -99,14 +61,65 @@ class XeroClient:
         self.user_agent = config.get("user_agent")
         self.tenant_id = None
         self.access_token = None
-
-    def refresh_credentials(self, config):
+        self.token_expires_at = None
+        self.cache = ResponseCache.from_config(config)
+        # streams picking up an interrupted sync, see set_resuming
+        self.resuming = set()
+        self.concurrency = ConcurrencyController.from_config(config)
+        self.decoder = Decoder(config.get("json_decoder", "auto"))
+        # API usage for this process, and the daily quota Xero last reported
+        self.calls = 0
+        self.bytes_received = 0
+        self.stream_usage = {}
+        self.day_limit_remaining = None
+
+    def refresh_credentials(self, config, force=False):
         self.tenant_id = config["tenant_id"]
+        # offline replays are served entirely from the response cache
+        if self.cache and self.cache.offline:
+            return
+        # a client kept between runs, as the daemon does, reuses its token
+        # until it's about to expire
+        if not force and self.access_token and self.token_expires_at:
+            if time.monotonic() < self.token_expires_at:
+                return
         # handles refresh, returns access token
-        self.access_token = get_token(config)
+        self.access_token, expires_in = get_token(config)
+        self.token_expires_at = None
+        if expires_in:
+            self.token_expires_at = (
+                time.monotonic() + float(expires_in) - TOKEN_EXPIRY_MARGIN
+            )
+
+    def set_resuming(self, tap_stream_id, resuming):
+        """Marks whether a stream is picking up where an interrupted sync left
+        off. Outside offline mode cached responses are only served to such a
+        stream: the pages the interrupted sync fetched, with the same
+        If-Modified-Since, are the ones it would have gone on to write,
+        whereas a fresh sync served a cached last page or unpaged response
+        would miss whatever was updated since."""
+        if resuming:
+            self.resuming.add(tap_stream_id)
+        else:
+            self.resuming.discard(tap_stream_id)
 
-    def fetch(self, tap_stream_id, since=None, **params):
+    def fetch_raw(self, tap_stream_id, since=None, **params):
+        """Returns the undecoded response body, from the response cache if
+        one is configured, holds a fresh copy of this request and may serve
+        it (see set_resuming)."""
         xero_resource_name = tap_stream_id.title().replace("_", "")
+        cache_key = None
+        if self.cache:
+            cache_key = ResponseCache.key(
+                self.tenant_id, xero_resource_name, params, since
+            )
+            if self.cache.offline or (
+                "page" in params and tap_stream_id in self.resuming
+            ):
+                text = self.cache.get(cache_key)
+                if text is not None:
+                    return text
+
         url = join(BASE_URL, xero_resource_name)
         headers = {
             "Accept": "application/json",
@@ -121,12 +134,33 @@ class XeroClient:
         request = requests.Request(
             "GET", url, headers=headers, params={**params, "includeArchived": "true"}
         )
-        response = self.session.send(request.prepare())
-        response.raise_for_status()
-        response_meta = json.loads(
-            response.text,
-            object_hook=_json_load_object_hook,
-            parse_float=decimal.Decimal,
+        self.concurrency.acquire()
+        started = time.monotonic()
+        try:
+            response = self.session.send(request.prepare())
+        except requests.exceptions.RequestException:
+            self.concurrency.release(time.monotonic() - started, throttled=True)
+            raise
+        self.concurrency.release(
+            time.monotonic() - started,
+            throttled=response.status_code in (429, 503),
         )
-        response_body = response_meta.pop(xero_resource_name)
-        return response_body
+        self.calls += 1
+        self.bytes_received += len(response.content)
+        usage = self.stream_usage.setdefault(tap_stream_id, {"calls": 0, "bytes": 0})
+        usage["calls"] += 1
+        usage["bytes"] += len(response.content)
+        day_limit_remaining = response.headers.get("X-DayLimit-Remaining")
+        if day_limit_remaining is not None:
+            self.day_limit_remaining = int(day_limit_remaining)
+        response.raise_for_status()
+        if cache_key:
+            self.cache.put(cache_key, response.text)
+        return response.text
+
+    def decode(self, tap_stream_id, text):
+        return self.decoder.decode(tap_stream_id, text)
+
+    def fetch(self, tap_stream_id, since=None, **params):
+        text = self.fetch_raw(tap_stream_id, since, **params)
+        return self.decode(tap_stream_id, text)
@@ -0,0 +1,76 @@
+import time
+import threading
+import singer
+
+LOGGER = singer.get_logger()
+
+# Xero allows a tenant 5 calls in progress at once
+DEFAULT_MAX_CONCURRENCY = 5
+DEFAULT_LATENCY_FACTOR = 2.0
+# Weight of the latest response in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+
+class ConcurrencyController:
+    """Limits a tenant's requests in flight, AIMD style: each healthy response
+    raises the limit by 1/limit, so by about one per round of requests, up to
+    max_limit, and a 429 or 503, a failed request or a response taking more
+    than latency_factor times the smoothed latency halves it. Decreases are
+    applied at most once per smoothed latency, so a burst of throttled
+    responses to requests sent together only counts once."""
+
+    def __init__(
+        self, max_limit=DEFAULT_MAX_CONCURRENCY, latency_factor=DEFAULT_LATENCY_FACTOR
+    ):
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.limit = 1.0
+        self.in_flight = 0
+        self.latency = None
+        self.decreases = 0
+        self.decreased_at = None
+        self.cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_limit=int(config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+            latency_factor=float(
+                config.get("concurrency_latency_factor", DEFAULT_LATENCY_FACTOR)
+            ),
+        )
+
+    def allowed(self):
+        """The number of requests currently allowed in flight."""
+        return int(self.limit)
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.allowed():
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.decrease("throttled")
+            elif self.latency and latency > self.latency * self.latency_factor:
+                self.decrease(f"a {latency:.1f}s response")
+            else:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            if not throttled:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+            self.cond.notify_all()
+
+    def decrease(self, reason):
+        now = time.monotonic()
+        if self.decreased_at and now - self.decreased_at < (self.latency or 0):
+            return
+        self.decreased_at = now
+        self.decreases += 1
+        self.limit = max(self.limit / 2, 1.0)
+        LOGGER.info("Cut requests in flight to %s after %s", self.allowed(), reason)
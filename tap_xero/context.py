@@ -1,17 +1,68 @@
-import singer
+import time
 from singer import bookmarks as bks_
 from .client import XeroClient
+from .sinks import sink_from_config
+from .workers import DecodePool
+from .decoding import catalog_plans
+from .validation import RecordTransformer
+from .dedup import Deduplicator
+from .reference import ReferenceIndex, DEFAULT_SNAPSHOT_TTL
+from .telemetry import Telemetry
+
+# How long before max_runtime the tap stops starting requests, leaving time
+# for the request in progress and writing out what it returned
+DEFAULT_RUNTIME_MARGIN = 60
 
 
 class Context:
-    def __init__(self, config, state, catalog):
+    def __init__(self, config, state, catalog, client=None, sink=None):
         self.config = config
         self.state = state
         self.catalog = catalog
-        self.client = XeroClient(config)
+        self.client = client or XeroClient(config)
+        self.sink = sink or sink_from_config(config)
+        self.decode_pool = None
+        self.records_written = 0
+        self.record_transformers = {}
+        self.dedup = Deduplicator.from_config(config, state)
+        self.reference = None
+        self.reference_loaded_at = None
+        self.telemetry = Telemetry.from_config(config, self.client)
+        # kept between runs, see reuse
+        self.warm = False
+        self.start_clock()
+        if catalog:
+            self.client.decoder.register(catalog_plans(catalog))
+
+    def start_clock(self):
+        """Sets the run's deadline from max_runtime, if there is one."""
+        config = self.config
+        self.deadline = None
+        if config.get("max_runtime"):
+            margin = float(config.get("max_runtime_margin", DEFAULT_RUNTIME_MARGIN))
+            self.deadline = time.monotonic() + float(config["max_runtime"]) - margin
+
+    def reuse(self, sink):
+        """Readies a context kept warm between runs for the next one, writing
+        to sink. The state, the client with its session and token, the
+        compiled transformers and the decode pool carry over, as does the
+        reference index until it's reference_snapshot_ttl old."""
+        self.warm = True
+        self.sink = sink
+        self.records_written = 0
+        self.start_clock()
+        ttl = float(self.config.get("reference_snapshot_ttl", DEFAULT_SNAPSHOT_TTL))
+        if self.reference and time.monotonic() - self.reference_loaded_at >= ttl:
+            self.reference = None
+            # the workers were started with the old index
+            self.shutdown_pool()
 
-    def refresh_credentials(self):
-        self.client.refresh_credentials(self.config)
+    def past_deadline(self, after=0):
+        """Whether the run's deadline will have passed in after seconds."""
+        return self.deadline is not None and time.monotonic() + after >= self.deadline
+
+    def refresh_credentials(self, force=False):
+        self.client.refresh_credentials(self.config, force)
 
     # If there isn't a bookmark, fall back to start date from config
     def get_bookmark(self, path):
@@ -28,8 +79,57 @@ class Context:
     def set_offset(self, path, val):
         bks_.set_offset(self.state, path[0], path[1], val)
 
+    def remove_offset(self, path):
+        (bks_.get_offset(self.state, path[0]) or {}).pop(path[1], None)
+
     def clear_offsets(self, tap_stream_id):
         bks_.clear_offset(self.state, tap_stream_id)
 
     def write_state(self):
-        singer.write_state(self.state)
+        if self.dedup:
+            self.dedup.save(self.state)
+        self.sink.write_state(self.state)
+
+    def record_transformer(self, tap_stream_id):
+        transformer = self.record_transformers.get(tap_stream_id)
+        if transformer is None:
+            entry = self.catalog.get_stream(tap_stream_id)
+            transformer = RecordTransformer.for_catalog_entry(entry, self.config)
+            self.record_transformers[tap_stream_id] = transformer
+        return transformer
+
+    def reference_index(self):
+        """The reference data index line items are enriched from, if enabled.
+        Built on first use."""
+        if not self.config.get("enrich_line_items"):
+            return None
+        if self.reference is None:
+            self.reference = ReferenceIndex.load(self)
+            self.reference_loaded_at = time.monotonic()
+        return self.reference
+
+    def get_decode_pool(self):
+        workers = int(self.config.get("decode_workers") or 0)
+        if workers and self.decode_pool is None:
+            self.decode_pool = DecodePool(
+                self.catalog,
+                workers,
+                self.client.decoder,
+                self.config,
+                self.reference_index(),
+            )
+        return self.decode_pool
+
+    def close(self):
+        if self.telemetry:
+            self.telemetry.flush()
+        if self.dedup:
+            self.dedup.log_dropped()
+        self.sink.close()
+        if not self.warm:
+            self.shutdown_pool()
+
+    def shutdown_pool(self):
+        if self.decode_pool:
+            self.decode_pool.shutdown()
+            self.decode_pool = None
@@ -0,0 +1,152 @@
+"""Stays resident and runs incremental syncs every interval seconds, and
+whenever it's sent SIGUSR1, so that frequent syncs don't each pay for
+starting Python, importing, loading schemas and exchanging a token.
+
+    tap-xero-daemon -c config.json --catalog cat.json -s state.json \
+        --interval 300 --output-dir out
+
+The client with its HTTP session and access token, the catalog, the compiled
+transformers and the decode pool are kept from one cycle to the next. Each
+cycle's Singer messages go to a file of their own in the output directory,
+renamed into place once the cycle is done, or else to stdout as usual. The
+state is carried between cycles and saved to the state file after each one.
+SIGTERM and SIGINT stop the cycle in progress at its next request,
+checkpointed as with max_runtime, and then the daemon."""
+import os
+import json
+import time
+import signal
+import argparse
+import singer
+from singer import utils
+from singer.catalog import Catalog
+from . import discover, load_json, run
+from .context import Context
+from .sinks import SingerSink, sink_from_config
+
+LOGGER = singer.get_logger()
+
+# How often a waiting daemon checks whether it's been triggered or stopped.
+# The signal handlers only set flags, as taking locks in them can deadlock
+POLL_SECONDS = 1
+
+
+class Daemon:
+    def __init__(
+        self, config, catalog, state, state_path=None, output_dir=None, client=None
+    ):
+        self.state_path = state_path
+        self.output_dir = output_dir
+        self.interval = config.get("daemon_interval")
+        # each cycle is given its sink by run_cycle, so none is built from
+        # config here, where a buffered one would start a writer never closed
+        self.ctx = Context(config, state, catalog, client, sink=SingerSink())
+        self.triggered = False
+        self.stopping = False
+        self.cycles = 0
+
+    def trigger(self):
+        """Starts the next cycle now, or as soon as the current one is done."""
+        self.triggered = True
+
+    def stop(self):
+        self.stopping = True
+        # the running sync stops before its next request
+        self.ctx.deadline = time.monotonic()
+
+    def run(self, max_cycles=None):
+        try:
+            while not self.stopping:
+                started = time.monotonic()
+                self.triggered = False
+                self.run_cycle()
+                if max_cycles and self.cycles >= max_cycles:
+                    break
+                next_cycle = None
+                if self.interval:
+                    next_cycle = started + float(self.interval)
+                while not (self.triggered or self.stopping):
+                    wait = POLL_SECONDS
+                    if next_cycle is not None:
+                        wait = min(wait, next_cycle - time.monotonic())
+                        if wait <= 0:
+                            break
+                    time.sleep(wait)
+        finally:
+            self.ctx.shutdown_pool()
+
+    def run_cycle(self):
+        self.cycles += 1
+        started = time.monotonic()
+        out = path = None
+        if self.output_dir:
+            name = utils.now().strftime("%Y%m%dT%H%M%S%fZ") + ".singer"
+            path = os.path.join(self.output_dir, name)
+            out = open(f"{path}.{os.getpid()}.tmp", "w")
+            sink = SingerSink(out)
+        else:
+            sink = sink_from_config(self.ctx.config)
+        self.ctx.reuse(sink)
+        if self.stopping:
+            self.ctx.deadline = time.monotonic()
+        try:
+            run(self.ctx)
+        except Exception:
+            # what was written up to the failure is checkpointed, so the next
+            # cycle carries on from there
+            LOGGER.exception("Cycle %s failed", self.cycles)
+        finally:
+            if out:
+                out.close()
+                os.replace(out.name, path)
+            self.save_state()
+        LOGGER.info(
+            "Cycle %s wrote %s records in %.1fs",
+            self.cycles,
+            self.ctx.records_written,
+            time.monotonic() - started,
+        )
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.ctx.state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="tap-xero-daemon")
+    parser.add_argument("-c", "--config", required=True)
+    parser.add_argument("--catalog")
+    parser.add_argument("-s", "--state")
+    parser.add_argument("--interval", type=float)
+    parser.add_argument("--output-dir")
+    args = parser.parse_args()
+
+    config = load_json(args.config)
+    if args.interval:
+        config["daemon_interval"] = args.interval
+    client = None
+    if args.catalog:
+        catalog = Catalog.from_dict(load_json(args.catalog))
+    else:
+        discovery = Context(config, {}, {})
+        catalog = discover(discovery)
+        # keep the token discovery exchanged for
+        client = discovery.client
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    daemon = Daemon(
+        config,
+        catalog,
+        load_json(args.state, {}),
+        state_path=args.state,
+        output_dir=args.output_dir,
+        client=client,
+    )
+    signal.signal(signal.SIGUSR1, lambda *_: daemon.trigger())
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    daemon.run()
@@ -0,0 +1,224 @@
+import re
+import json
+import decimal
+from datetime import datetime, date, time, timedelta
+from singer.utils import strftime, strptime_to_utc
+import six
+import pytz
+from .streams import sub_stream_ids, sub_stream_suffix, sub_parent_key
+
+DATE = "date"
+NUMBER = "number"
+# Streams whose format_fn reshapes the response, so the schema's paths aren't
+# the response's and they're decoded the legacy way
+UNPLANNED_STREAMS = {"tracking_categories"}
+# Keys sub rows are built from that differ from the key in the substream
+SUB_ROW_SOURCES = {"journals": {"Tracking": "TrackingCategories"}}
+
+
+def parse_date(value):
+    # Xero datetimes can be .NET JSON date strings which look like
+    # "/Date(1419937200000+0000)/"
+    # https://developer.xero.com/documentation/api/requests-and-responses
+    pattern = r"Date\((\-?\d+)([-+])?(\d+)?\)"
+    match = re.search(pattern, value)
+
+    iso8601pattern = r"((\d{4})-([0-2]\d)-0?([0-3]\d)T([0-5]\d):([0-5]\d):([0-6]\d))"
+
+    if not match:
+        iso8601match = re.search(iso8601pattern, value)
+        if iso8601match:
+            try:
+                return strptime_to_utc(value)
+            except Exception:
+                return None
+        else:
+            return None
+
+    millis_timestamp, offset_sign, offset = match.groups()
+    if offset:
+        if offset_sign == "+":
+            offset_sign = 1
+        else:
+            offset_sign = -1
+        offset_hours = offset_sign * int(offset[:2])
+        offset_minutes = offset_sign * int(offset[2:])
+    else:
+        offset_hours = 0
+        offset_minutes = 0
+
+    return datetime.utcfromtimestamp((int(millis_timestamp) / 1000)) + timedelta(
+        hours=offset_hours, minutes=offset_minutes
+    )
+
+
+def normalise_date(value):
+    """Returns the RFC3339 form of a Xero date string, or None if it isn't one."""
+    value = parse_date(value)
+    if not value:
+        return None
+    # NB> Pylint disabled because, regardless of idioms, this is more explicit than isinstance.
+    if type(value) is date:  # pylint: disable=unidiomatic-typecheck
+        value = datetime.combine(value, time.min)
+    value = value.replace(tzinfo=pytz.UTC)
+    return strftime(value)
+
+
+def _json_load_object_hook(_dict):
+    """Hook for json.parse(...) to parse Xero date formats."""
+    # This was taken from the pyxero library and modified
+    # to format the dates according to RFC3339
+    for key, value in _dict.items():
+        if isinstance(value, six.string_types):
+            value = normalise_date(value)
+            if value:
+                _dict[key] = value
+    return _dict
+
+
+def compile_plan(schema):
+    """Reduces a JSON schema to the paths the decoder has to touch: a tree of
+    {property: DATE | NUMBER | subtree}. Every string property is a DATE path,
+    not just the date-time ones, since the legacy decode turns any string
+    holding a Xero date into RFC3339. Arrays are transparent, so a subtree
+    applies to each element of a list found at that property."""
+    plan = {}
+    for key, prop in schema.get("properties", {}).items():
+        types = prop.get("type", [])
+        types = types if isinstance(types, list) else [types]
+        if "items" in prop:
+            prop = prop["items"]
+            types = prop.get("type", [])
+            types = types if isinstance(types, list) else [types]
+        if prop.get("format") == "date-time" or "string" in types:
+            plan[key] = DATE
+        elif "number" in types:
+            plan[key] = NUMBER
+        elif "properties" in prop:
+            subplan = compile_plan(prop)
+            if subplan:
+                plan[key] = subplan
+    return plan
+
+
+def _merge_plans(plan, other):
+    for key, node in other.items():
+        if isinstance(node, dict) and isinstance(plan.get(key), dict):
+            _merge_plans(plan[key], node)
+        else:
+            plan.setdefault(key, node)
+    return plan
+
+
+def catalog_plans(catalog):
+    """Decode plans for each selected stream. Line items are built from the
+    parent's raw response, so a selected substream's schema is merged into
+    its parent's plan under the key the rows come from."""
+    entries = {e.tap_stream_id: e for e in catalog.streams if e.is_selected()}
+    plans = {}
+    for stream_id, entry in entries.items():
+        if stream_id in sub_stream_ids or stream_id in UNPLANNED_STREAMS:
+            continue
+        plan = compile_plan(entry.schema.to_dict())
+        sub = entries.get(stream_id + sub_stream_suffix)
+        if sub:
+            row_plan = compile_plan(sub.schema.to_dict())
+            for key, source in SUB_ROW_SOURCES.get(stream_id, {}).items():
+                if key in row_plan:
+                    row_plan[source] = row_plan.pop(key)
+            _merge_plans(plan, {sub_parent_key(stream_id): row_plan})
+        plans[stream_id] = plan
+    return plans
+
+
+def _apply_plan(obj, plan, exact_numbers):
+    for key, node in plan.items():
+        value = obj.get(key)
+        if value is None:
+            continue
+        if isinstance(node, dict):
+            if isinstance(value, dict):
+                _apply_plan(value, node, exact_numbers)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        _apply_plan(item, node, exact_numbers)
+        elif node == DATE:
+            # a cheap check before the regexes: either kind of Xero date has one
+            if isinstance(value, str) and ("Date(" in value or ":" in value):
+                normalised = normalise_date(value)
+                if normalised:
+                    obj[key] = normalised
+        elif not exact_numbers:
+            if isinstance(value, float):
+                # Xero amounts carry at most a handful of decimal places, well
+                # within the 15 significant digits a float's shortest repr
+                # round-trips, so this recovers the value that was on the wire
+                obj[key] = decimal.Decimal(repr(value))
+            elif isinstance(value, list):
+                obj[key] = [
+                    decimal.Decimal(repr(v)) if isinstance(v, float) else v
+                    for v in value
+                ]
+
+
+def _stdlib_loads(text):
+    return json.loads(text, parse_float=decimal.Decimal)
+
+
+def _load_backend(name):
+    """Returns (loads, exact_numbers) for a backend name. exact_numbers means
+    the backend already yields Decimals for non-integer numbers."""
+    if name == "orjson":
+        import orjson  # pylint: disable=import-outside-toplevel
+
+        return orjson.loads, False
+    if name == "simdjson":
+        import simdjson  # pylint: disable=import-outside-toplevel
+
+        return simdjson.loads, False
+    if name == "json":
+        return _stdlib_loads, True
+    raise Exception(f"Unknown json_decoder '{name}'")
+
+
+class Decoder:
+    """Decodes Xero responses. The "legacy" backend is the original stdlib
+    decode with a date-sniffing object_hook on every object. The other
+    backends decode without hooks and then normalise dates and numbers in a
+    single pass over only the string and number paths in the stream's
+    schema, which are all that reach the output. Streams without a
+    registered plan always use the legacy decode."""
+
+    def __init__(self, backend="auto"):
+        if backend == "auto":
+            for name in ("orjson", "simdjson", "json"):
+                try:
+                    self.loads, self.exact_numbers = _load_backend(name)
+                except ImportError:
+                    continue
+                backend = name
+                break
+        elif backend != "legacy":
+            self.loads, self.exact_numbers = _load_backend(backend)
+        self.backend = backend
+        self.plans = {}
+
+    def register(self, plans):
+        self.plans.update(plans)
+
+    def decode(self, tap_stream_id, text):
+        xero_resource_name = tap_stream_id.title().replace("_", "")
+        plan = self.plans.get(tap_stream_id)
+        if self.backend == "legacy" or plan is None:
+            response_meta = json.loads(
+                text,
+                object_hook=_json_load_object_hook,
+                parse_float=decimal.Decimal,
+            )
+            return response_meta.pop(xero_resource_name)
+
+        records = self.loads(text)[xero_resource_name]
+        for record in records:
+            _apply_plan(record, plan, self.exact_numbers)
+        return records
@@ -0,0 +1,114 @@
+import json
+import hashlib
+from collections import OrderedDict
+import singer
+
+LOGGER = singer.get_logger()
+
+STATE_KEY = "dedup"
+DEFAULT_MAX_KEYS = 200000
+
+
+def record_key(stream, record):
+    """A short digest of a record's primary key."""
+    values = [record.get(field) for field in stream.pk_fields]
+    return hashlib.blake2b(
+        json.dumps(values, default=str).encode(), digest_size=8
+    ).hexdigest()
+
+
+class StreamDedup:
+    """The version (bookmark value) last emitted for each of a stream's
+    records, for at most max_keys records: past that, the least recently seen
+    ones are forgotten. Also tracks the records at the latest version, which
+    the next run's inclusive bookmark will return again."""
+
+    def __init__(self, max_keys, boundary=None):
+        self.max_keys = max_keys
+        self.seen = OrderedDict()
+        self.version = None
+        self.boundary = set()
+        self.dropped = 0
+        if boundary:
+            for key in boundary["keys"]:
+                self.add(key, boundary["version"])
+
+    def is_new(self, key, version):
+        """Whether the record wasn't emitted at this version yet. Counts it as
+        dropped if it was."""
+        if self.seen.get(key) == version:
+            self.seen.move_to_end(key)
+            self.dropped += 1
+            return False
+        return True
+
+    def add(self, key, version):
+        """Remembers the record as emitted at version, once it's written."""
+        self.seen[key] = version
+        self.seen.move_to_end(key)
+        if len(self.seen) > self.max_keys:
+            self.seen.popitem(last=False)
+        if self.version is None or version > self.version:
+            self.version = version
+            self.boundary = {key}
+        elif version == self.version and len(self.boundary) < self.max_keys:
+            self.boundary.add(key)
+
+    def saved(self):
+        return {"version": self.version, "keys": sorted(self.boundary)}
+
+
+class Deduplicator:
+    """Drops records already emitted at the same version, within a run and,
+    for records at a stream's bookmark, across runs."""
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS, saved=None):
+        self.max_keys = max_keys
+        self.saved = saved or {}
+        self.streams = {}
+
+    @classmethod
+    def from_config(cls, config, state):
+        if not config.get("dedup"):
+            return None
+        return cls(
+            int(config.get("dedup_max_keys", DEFAULT_MAX_KEYS)),
+            state.get(STATE_KEY),
+        )
+
+    def stream(self, stream):
+        dedup = self.streams.get(stream.tap_stream_id)
+        if dedup is None:
+            dedup = StreamDedup(self.max_keys, self.saved.get(stream.tap_stream_id))
+            self.streams[stream.tap_stream_id] = dedup
+        return dedup
+
+    def is_new(self, stream, record):
+        """Whether to emit the record. Streams without a bookmark aren't
+        deduped."""
+        if not stream.bookmark_key:
+            return True
+        return self.stream(stream).is_new(
+            record_key(stream, record), record[stream.bookmark_key]
+        )
+
+    def add(self, stream, record):
+        """Remembers the record as emitted, after it's been written, so a
+        record whose write failed isn't saved as seen."""
+        if stream.bookmark_key:
+            self.stream(stream).add(
+                record_key(stream, record), record[stream.bookmark_key]
+            )
+
+    def save(self, state):
+        saved = state.setdefault(STATE_KEY, {})
+        for tap_stream_id, dedup in self.streams.items():
+            if dedup.version is not None:
+                saved[tap_stream_id] = dedup.saved()
+
+    def log_dropped(self):
+        for tap_stream_id, dedup in self.streams.items():
+            if dedup.dropped:
+                LOGGER.info(
+                    "Dropped %s duplicate %s records", dedup.dropped, tap_stream_id
+                )
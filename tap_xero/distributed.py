@@ -0,0 +1,513 @@
+"""Splits a sync into units of work that several worker processes, on one box
+or several sharing a filesystem, claim through leases in a SQLite database.
+
+    tap-xero-distributed plan -c config.json --catalog cat.json -s state.json \
+        --work-dir work
+    tap-xero-distributed work -c config.json --catalog cat.json --work-dir work
+    tap-xero-distributed merge -c config.json --work-dir work | target-...
+
+Run as many "work" processes as the API limits allow.
+
+A unit is a (tenant, stream, date window) for the paginated streams, a
+(tenant, range of JournalNumber) for journals and a (tenant, stream) for the
+rest. Windows filter on UpdatedDateUTC rather than splitting by page number,
+since pages shift under a running backfill as records are updated. Journals
+are never updated, so their numbers don't shift. Each unit's Singer output
+goes to its own file and merge replays them in plan order followed by one
+merged state."""
+import os
+import sys
+import copy
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+import singer
+from singer import utils
+from singer.catalog import Catalog
+from singer.utils import strftime, strptime_to_utc
+from . import load_and_write_schema, load_json
+from .context import Context
+from .sinks import SingerSink
+from .streams import (
+    all_streams,
+    streams_by_id,
+    sub_stream_ids,
+    sub_stream_suffix,
+    PaginatedStream,
+    Journals,
+    FULL_PAGE_SIZE,
+    _make_request,
+)
+
+LOGGER = singer.get_logger()
+
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_JOURNAL_RANGE = 10000
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+def tenant_ids(config):
+    return config.get("tenant_ids") or [config["tenant_id"]]
+
+
+def split_state(config, state):
+    """The per-tenant states in a run's state. With several tenant_ids the
+    state holds one Singer state per tenant under "tenants"."""
+    state = state or {}
+    if not config.get("tenant_ids"):
+        return {config["tenant_id"]: state}
+    return dict(state.get("tenants", {}))
+
+
+def join_states(config, states):
+    if not config.get("tenant_ids"):
+        return states.get(config["tenant_id"], {})
+    return {"tenants": states}
+
+
+def latest_journal_number(ctx):
+    """The tenant's greatest JournalNumber. The Journals endpoint only pages
+    forwards from an offset, so this searches for an offset whose page isn't
+    full: a full page means there are journals past offset + 100, an empty
+    one that there are none past offset."""
+    low, high = 0, None
+    offset = 0
+    while True:
+        records = _make_request(ctx, "journals", {"offset": offset})
+        if records and len(records) < FULL_PAGE_SIZE:
+            return max(r["JournalNumber"] for r in records)
+        if records:
+            low = offset
+        elif offset == 0:
+            return 0
+        else:
+            high = offset
+        offset = low * 2 + FULL_PAGE_SIZE if high is None else (low + high) // 2
+
+
+def plan_units(
+    config,
+    catalog,
+    states,
+    window_days=DEFAULT_WINDOW_DAYS,
+    now=None,
+    latest_journals=None,
+    journal_range=DEFAULT_JOURNAL_RANGE,
+):
+    """Units of work for every selected parent stream of every tenant. A
+    paginated stream is cut into windows of window_days from its bookmark,
+    the last one left open-ended. Journals are cut the same way into ranges
+    of journal_range JournalNumbers, up to the tenant's latest in
+    latest_journals, if it's there. Other streams are one unit carrying the
+    stream's current bookmark."""
+    latest_journals = latest_journals or {}
+    selected = {e.tap_stream_id for e in catalog.streams if e.is_selected()}
+    now = now or utils.now()
+    units = []
+    for tenant_id in tenant_ids(config):
+        state = states.get(tenant_id) or {}
+        for stream in all_streams:
+            stream_id = stream.tap_stream_id
+            if stream_id not in selected or stream_id in sub_stream_ids:
+                continue
+            bookmark = state.get("bookmarks", {}).get(stream_id)
+            if isinstance(stream, Journals) and tenant_id in latest_journals:
+                number = (bookmark or {}).get(stream.bookmark_key) or 0
+                index = 0
+                while number + journal_range < latest_journals[tenant_id]:
+                    end = number + journal_range
+                    units.append(_unit(tenant_id, stream_id, index, number, end))
+                    number = end
+                    index += 1
+                units.append(_unit(tenant_id, stream_id, index, number))
+                continue
+            if not isinstance(stream, PaginatedStream):
+                unit = _unit(tenant_id, stream_id, 0)
+                if bookmark:
+                    unit["state"] = {"bookmarks": {stream_id: bookmark}}
+                units.append(unit)
+                continue
+            start = strptime_to_utc(
+                (bookmark or {}).get(stream.bookmark_key) or config["start_date"]
+            )
+            index = 0
+            while True:
+                end = start + timedelta(days=window_days)
+                if end >= now:
+                    units.append(_unit(tenant_id, stream_id, index, strftime(start)))
+                    break
+                units.append(
+                    _unit(tenant_id, stream_id, index, strftime(start), strftime(end))
+                )
+                start = end
+                index += 1
+    return units
+
+
+def _unit(tenant_id, stream_id, index, start=None, end=None):
+    unit = {
+        "id": f"{tenant_id}/{stream_id}/{index}",
+        "tenant_id": tenant_id,
+        "stream": stream_id,
+        "index": index,
+    }
+    if start is not None:
+        unit.update(window=True, start=start, end=end)
+    return unit
+
+
+class LeaseStore:
+    """Units of work and their leases. A worker owns a unit while its lease
+    is unexpired; once a lease lapses, say because the worker died, the unit
+    can be claimed again, up to max_attempts claims in all."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS units (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                unit TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT
+            )"""
+        )
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can't both
+        # read a unit as claimable
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add(self, units):
+        """Adds a plan's units. Refuses to add to a store already holding a
+        plan: unit ids repeat between plans, so a second plan's windows would
+        be mistaken for the first's."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM units LIMIT 1").fetchone():
+                raise Exception(
+                    f"{self.path} already holds a plan; plan into a new work "
+                    "directory"
+                )
+            conn.executemany(
+                "INSERT INTO units (id, unit, status) VALUES (?, ?, ?)",
+                [(unit["id"], json.dumps(unit), PENDING) for unit in units],
+            )
+
+    def claim(self, owner, lease_seconds, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                """SELECT id, unit FROM units
+                WHERE (status = ? OR (status = ? AND expires < ?)) AND attempts < ?
+                ORDER BY seq LIMIT 1""",
+                (PENDING, LEASED, now, max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """UPDATE units SET status = ?, owner = ?, expires = ?,
+                attempts = attempts + 1 WHERE id = ?""",
+                (LEASED, owner, now + lease_seconds, row[0]),
+            )
+        return json.loads(row[1])
+
+    def _update_lease(self, sql, unit_id, owner, *params):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                sql + " WHERE id = ? AND owner = ? AND status = ?",
+                (*params, unit_id, owner, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, unit_id, owner, lease_seconds):
+        return self._update_lease(
+            "UPDATE units SET expires = ?",
+            unit_id,
+            owner,
+            time.time() + lease_seconds,
+        )
+
+    def complete(self, unit_id, owner, result):
+        """Marks a unit done, unless its lease lapsed and it was claimed again."""
+        return self._update_lease(
+            "UPDATE units SET status = ?, result = ?",
+            unit_id,
+            owner,
+            DONE,
+            json.dumps(result),
+        )
+
+    def release(self, unit_id, owner):
+        return self._update_lease(
+            "UPDATE units SET status = ?, owner = NULL", unit_id, owner, PENDING
+        )
+
+    def units(self):
+        """(unit, status, result) for every unit, in plan order."""
+        rows = self.conn.execute("SELECT unit, status, result FROM units ORDER BY seq")
+        return [
+            (json.loads(unit), status, json.loads(result) if result else None)
+            for unit, status, result in rows
+        ]
+
+    def close(self):
+        self.conn.close()
+
+
+class Heartbeat(threading.Thread):
+    """Renews a unit's lease in the background while the unit runs."""
+
+    def __init__(self, store_path, unit_id, owner, lease_seconds):
+        super().__init__(daemon=True)
+        self.store_path = store_path
+        self.unit_id = unit_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        # sqlite connections can't be shared between threads
+        store = LeaseStore(self.store_path)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not store.renew(self.unit_id, self.owner, self.lease_seconds):
+                    LOGGER.warning("Lost the lease on %s", self.unit_id)
+                    return
+        finally:
+            store.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class UnitSink(SingerSink):
+    """A unit's Singer messages without its states, which only cover the
+    unit's stream and tenant. merge writes one state for the whole run.
+
+    Given a tenant_id, as with several tenant_ids, records carry it as
+    TenantID and it leads the key properties, since the tenants' records go
+    to the same streams and keys like currencies' Code repeat across them."""
+
+    def __init__(self, out=None, tenant_id=None):
+        super().__init__(out)
+        self.tenant_id = tenant_id
+
+    def write_schema(self, stream_id, schema, key_properties):
+        if self.tenant_id:
+            properties = {**schema["properties"], "TenantID": {"type": ["string"]}}
+            schema = {**schema, "properties": properties}
+            key_properties = ["TenantID"] + list(key_properties)
+        super().write_schema(stream_id, schema, key_properties)
+
+    def write_record(self, stream_id, record):
+        if self.tenant_id:
+            record = {**record, "TenantID": self.tenant_id}
+        super().write_record(stream_id, record)
+
+    def write_state(self, state):
+        pass
+
+
+def unit_output_path(work_dir, unit):
+    return os.path.join(work_dir, "output", unit["id"].replace("/", "-") + ".singer")
+
+
+class Worker:
+    """Claims and runs units until there are none left to claim."""
+
+    def __init__(self, config, catalog, work_dir, owner=None, lease_seconds=None):
+        self.config = config
+        self.catalog = catalog
+        self.work_dir = work_dir
+        self.store_path = os.path.join(work_dir, "leases.sqlite")
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = float(
+            lease_seconds or config.get("lease_seconds", DEFAULT_LEASE_SECONDS)
+        )
+        self.access_token = None
+        if config.get("export_dir"):
+            raise Exception(
+                "export_dir isn't supported by distributed runs, whose output "
+                "is written by merge"
+            )
+
+    def run(self):
+        store = LeaseStore(self.store_path)
+        os.makedirs(os.path.join(self.work_dir, "output"), exist_ok=True)
+        done = 0
+        try:
+            while True:
+                unit = store.claim(self.owner, self.lease_seconds)
+                if unit is None:
+                    return done
+                LOGGER.info("%s running %s", self.owner, unit["id"])
+                heartbeat = Heartbeat(
+                    self.store_path, unit["id"], self.owner, self.lease_seconds
+                )
+                heartbeat.start()
+                path = unit_output_path(self.work_dir, unit)
+                # a worker whose lease lapsed may still be writing the same unit
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    with open(tmp_path, "w") as out:
+                        result = self.run_unit(unit, out)
+                    os.replace(tmp_path, path)
+                except Exception:
+                    heartbeat.stop()
+                    store.release(unit["id"], self.owner)
+                    raise
+                heartbeat.stop()
+                if store.complete(unit["id"], self.owner, result):
+                    done += 1
+                else:
+                    LOGGER.warning("%s was taken over by another worker", unit["id"])
+        finally:
+            store.close()
+
+    def run_unit(self, unit, out):
+        """Syncs a unit, writing its Singer messages to out. Returns the result
+        merge_states needs: the greatest UpdatedDateUTC, or JournalNumber, seen
+        in a window, or the stream's bookmark after a whole-stream sync."""
+        config = {**self.config, "tenant_id": unit["tenant_id"]}
+        state = copy.deepcopy(unit.get("state") or {})
+        sink = UnitSink(out, unit["tenant_id"] if config.get("tenant_ids") else None)
+        ctx = Context(config, state, self.catalog, sink=sink)
+        # one token serves every tenant on the connection, so it's only
+        # exchanged again when a request comes back unauthorised
+        if self.access_token:
+            ctx.client.tenant_id = unit["tenant_id"]
+            ctx.client.access_token = self.access_token
+        else:
+            ctx.refresh_credentials()
+        stream = streams_by_id[unit["stream"]]
+        sub_entry = self.catalog.get_stream(stream.tap_stream_id + sub_stream_suffix)
+        sub = None
+        load_and_write_schema(ctx, stream)
+        if sub_entry and sub_entry.is_selected():
+            sub = streams_by_id[sub_entry.tap_stream_id]
+            load_and_write_schema(ctx, sub)
+        try:
+            if unit.get("window"):
+                max_updated = stream.sync_window(ctx, sub, unit["start"], unit["end"])
+                return {"max_updated": max_updated}
+            stream.sync(ctx, sub)
+            return {"bookmark": ctx.state.get("bookmarks", {}).get(unit["stream"])}
+        finally:
+            self.access_token = ctx.client.access_token
+            ctx.close()
+
+
+def merge_states(states, units):
+    """Folds finished units back into the per-tenant states. A windowed stream's
+    bookmark advances over the leading run of finished windows: to the end of
+    the last one, or for the open-ended final window to the latest record
+    seen. Windows after an unfinished one are synced again next time."""
+    merged = copy.deepcopy(states)
+    windows = {}
+    for unit, status, result in units:
+        state = merged.setdefault(unit["tenant_id"], {})
+        if unit.get("window"):
+            windows.setdefault((unit["tenant_id"], unit["stream"]), []).append(
+                (unit, status, result)
+            )
+        elif status == DONE and result.get("bookmark"):
+            state.setdefault("bookmarks", {})[unit["stream"]] = result["bookmark"]
+
+    for (tenant_id, stream_id), stream_units in windows.items():
+        bookmark = None
+        for unit, status, result in sorted(stream_units, key=lambda u: u[0]["index"]):
+            if status != DONE:
+                break
+            bookmark = unit["end"] or result.get("max_updated") or unit["start"]
+        if bookmark:
+            state = merged[tenant_id]
+            singer.write_bookmark(
+                state, stream_id, streams_by_id[stream_id].bookmark_key, bookmark
+            )
+            singer.clear_offset(state, stream_id)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="tap-xero-distributed")
+    parser.add_argument("command", choices=["plan", "work", "merge"])
+    parser.add_argument("-c", "--config", required=True)
+    parser.add_argument("--catalog")
+    parser.add_argument("-s", "--state")
+    parser.add_argument("--work-dir", required=True)
+    args = parser.parse_args()
+
+    config = load_json(args.config)
+    os.makedirs(args.work_dir, exist_ok=True)
+    base_state_path = os.path.join(args.work_dir, "base_state.json")
+    store_path = os.path.join(args.work_dir, "leases.sqlite")
+
+    if args.command == "plan":
+        catalog = Catalog.from_dict(load_json(args.catalog))
+        state = load_json(args.state, {})
+        latest_journals = {}
+        journals = catalog.get_stream("journals")
+        if journals and journals.is_selected():
+            # one token serves every tenant, as in run_unit
+            first = {**config, "tenant_id": tenant_ids(config)[0]}
+            ctx = Context(first, {}, catalog, sink=SingerSink())
+            ctx.refresh_credentials()
+            for tenant_id in tenant_ids(config):
+                ctx.client.tenant_id = tenant_id
+                latest_journals[tenant_id] = latest_journal_number(ctx)
+            ctx.close()
+        units = plan_units(
+            config,
+            catalog,
+            split_state(config, state),
+            window_days=int(config.get("window_days", DEFAULT_WINDOW_DAYS)),
+            latest_journals=latest_journals,
+            journal_range=int(config.get("journal_range", DEFAULT_JOURNAL_RANGE)),
+        )
+        store = LeaseStore(store_path)
+        try:
+            store.add(units)
+        finally:
+            store.close()
+        with open(base_state_path, "w") as f:
+            json.dump(state, f)
+        LOGGER.info("Planned %s units in %s", len(units), args.work_dir)
+    elif args.command == "work":
+        catalog = Catalog.from_dict(load_json(args.catalog))
+        done = Worker(config, catalog, args.work_dir).run()
+        LOGGER.info("Worker finished %s units", done)
+    else:
+        store = LeaseStore(store_path)
+        units = store.units()
+        store.close()
+        unfinished = [unit["id"] for unit, status, _ in units if status != DONE]
+        if unfinished:
+            LOGGER.warning("Unfinished units: %s", ", ".join(unfinished))
+        for unit, status, _ in units:
+            if status == DONE:
+                with open(unit_output_path(args.work_dir, unit)) as f:
+                    for line in f:
+                        sys.stdout.write(line)
+        states = merge_states(split_state(config, load_json(base_state_path)), units)
+        singer.write_state(join_states(config, states))
@@ -0,0 +1,100 @@
+import time
+from datetime import datetime, timezone
+import singer
+
+LOGGER = singer.get_logger()
+
+STATS_KEY = "stream_stats"
+USAGE_KEY = "api_usage"
+DEFAULT_DAILY_CALL_LIMIT = 5000
+# Weight of the latest run in the smoothed per-stream call estimate
+CALLS_SMOOTHING = 0.5
+
+
+def _today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class StreamPlanner:
+    """Plans a run from per-stream statistics kept in state: streams run in
+    priority order, and a stream whose estimated API calls won't fit in what's
+    left of the daily quota is deferred to a later run rather than started.
+
+    For each stream the state records the calls, records, bytes and duration
+    of its last completed sync, plus a smoothed call estimate."""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.priorities = ctx.config.get("stream_priorities") or {}
+        self.reserve = int(ctx.config.get("daily_call_reserve", 0))
+        self.daily_limit = int(
+            ctx.config.get("daily_call_limit", DEFAULT_DAILY_CALL_LIMIT)
+        )
+        self.deferred = []
+
+    def order(self, streams):
+        # sorted is stable, so streams without a priority keep their usual order
+        return sorted(streams, key=lambda s: -self.priorities.get(s.tap_stream_id, 0))
+
+    def stats(self, tap_stream_id):
+        return self.ctx.state.get(STATS_KEY, {}).get(tap_stream_id)
+
+    def estimated_calls(self, tap_stream_id):
+        stats = self.stats(tap_stream_id)
+        return stats["avg_calls"] if stats else 1
+
+    def remaining_calls(self):
+        remaining = self.ctx.client.day_limit_remaining
+        if remaining is None:
+            usage = self.ctx.state.get(USAGE_KEY) or {}
+            if usage.get("date") == _today():
+                remaining = usage["remaining"]
+            else:
+                remaining = self.daily_limit
+        return remaining - self.reserve
+
+    def should_defer(self, tap_stream_id):
+        estimate = self.estimated_calls(tap_stream_id)
+        remaining = self.remaining_calls()
+        if estimate <= remaining:
+            return False
+        LOGGER.warning(
+            "Deferring stream %s: estimated %s API calls but only %s left today",
+            tap_stream_id,
+            round(estimate),
+            remaining,
+        )
+        self.deferred.append(tap_stream_id)
+        return True
+
+    def defer_rest(self, tap_stream_ids):
+        self.deferred.extend(tap_stream_ids)
+        LOGGER.warning("Deferred streams to a later run: %s", ", ".join(self.deferred))
+
+    def run(self, stream, sub):
+        """Syncs a stream and records what it cost."""
+        client = self.ctx.client
+        calls, nbytes = client.calls, client.bytes_received
+        records = self.ctx.records_written
+        started = time.monotonic()
+        stream.sync(self.ctx, sub)
+        calls = client.calls - calls
+        previous = self.stats(stream.tap_stream_id)
+        avg_calls = (
+            calls
+            if previous is None
+            else CALLS_SMOOTHING * calls + (1 - CALLS_SMOOTHING) * previous["avg_calls"]
+        )
+        self.ctx.state.setdefault(STATS_KEY, {})[stream.tap_stream_id] = {
+            "calls": calls,
+            "records": self.ctx.records_written - records,
+            "bytes": client.bytes_received - nbytes,
+            "duration": round(time.monotonic() - started, 3),
+            "avg_calls": round(avg_calls, 2),
+        }
+        self.record_usage()
+
+    def record_usage(self):
+        remaining = self.ctx.client.day_limit_remaining
+        if remaining is not None:
+            self.ctx.state[USAGE_KEY] = {"date": _today(), "remaining": remaining}
@@ -0,0 +1,151 @@
+import os
+import json
+import singer
+from singer import metrics, utils
+from singer.utils import strftime
+from .streams import _make_request, streams_by_id, FULL_PAGE_SIZE
+from .targeted import fetch_ids
+
+LOGGER = singer.get_logger()
+
+STREAM_ID = "reconciliation_events"
+KEY_PROPERTIES = ["TapStreamID", "RecordID", "DetectedAt"]
+DELETED = "deleted"
+STATUS_CHANGED = "status_changed"
+DEFAULT_PAGE_SIZE = 1000
+# The field holding each reconcilable stream's status
+STATUS_FIELDS = {
+    "bank_transactions": "Status",
+    "contacts": "ContactStatus",
+    "credit_notes": "Status",
+    "invoices": "Status",
+    "manual_journals": "Status",
+    "purchase_orders": "Status",
+}
+# Endpoints that can leave out line items and the like with summaryOnly
+SUMMARY_ONLY_STREAMS = {"contacts", "invoices"}
+
+
+def requested(config):
+    return bool(config.get("reconcile_streams"))
+
+
+def fetch_statuses(ctx, stream, page_size):
+    """The status of every record in a stream, by ID, fetched page_size at a
+    time and without If-Modified-Since, since records can vanish without
+    their UpdatedDateUTC changing. Pages are ordered by ID, which unlike
+    UpdatedDateUTC doesn't change under a running scan, and read until an
+    empty one, in case the endpoint doesn't honour pageSize."""
+    xero_resource_name = stream.tap_stream_id.title().replace("_", "")
+    pk = stream.pk_fields[0]
+    status_field = STATUS_FIELDS[stream.tap_stream_id]
+    params = {"pageSize": page_size, "order": f"{pk} ASC"}
+    if stream.tap_stream_id in SUMMARY_ONLY_STREAMS:
+        params["summaryOnly"] = "true"
+    statuses = {}
+    page = 1
+    while True:
+        # only the ID and status are needed, so skip the decoder's date handling
+        text = _make_request(
+            ctx, stream.tap_stream_id, {**params, "page": page}, raw=True
+        )
+        records = json.loads(text)[xero_resource_name]
+        if not records:
+            return statuses
+        for record in records:
+            statuses[record[pk]] = record.get(status_field)
+        page += 1
+
+
+def confirm_missing(ctx, stream, previous, current):
+    """Looks up the records in previous that the scan didn't see by ID, adding
+    those that do still exist to current. Records deleted during the scan
+    shift the later pages, so a record that's still there can be missed."""
+    pk = stream.pk_fields[0]
+    status_field = STATUS_FIELDS[stream.tap_stream_id]
+    missing = [record_id for record_id in previous if record_id not in current]
+    for i in range(0, len(missing), FULL_PAGE_SIZE):
+        for records in fetch_ids(ctx, stream, missing[i : i + FULL_PAGE_SIZE]):
+            for record in records:
+                current[record[pk]] = record.get(status_field)
+
+
+def compare(previous, current):
+    """Yields (record ID, event, previous status, status) for records that
+    have gone since the previous index or whose status has changed."""
+    for record_id, status in previous.items():
+        if record_id not in current:
+            yield record_id, DELETED, status, None
+        elif current[record_id] != status:
+            yield record_id, STATUS_CHANGED, status, current[record_id]
+
+
+class StatusIndex:
+    """The IDs and statuses a stream had at the last reconciliation, in a JSON
+    file per tenant and stream."""
+
+    def __init__(self, directory, tenant_id, tap_stream_id):
+        self.path = os.path.join(directory, tenant_id, tap_stream_id + ".json")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, statuses):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(statuses, f)
+        os.replace(tmp_path, self.path)
+
+
+def reconcile_stream(ctx, stream, index, page_size, detected_at):
+    current = fetch_statuses(ctx, stream, page_size)
+    previous = index.load()
+    if previous is None:
+        LOGGER.info(
+            "Indexed %s %s records for the next reconciliation",
+            len(current),
+            stream.tap_stream_id,
+        )
+        index.save(current)
+        return 0
+
+    confirm_missing(ctx, stream, previous, current)
+    events = 0
+    with metrics.record_counter(STREAM_ID) as counter:
+        for record_id, event, previous_status, status in compare(previous, current):
+            ctx.sink.write_record(
+                STREAM_ID,
+                {
+                    "TapStreamID": stream.tap_stream_id,
+                    "RecordID": record_id,
+                    "Event": event,
+                    "PreviousStatus": previous_status,
+                    "Status": status,
+                    "DetectedAt": detected_at,
+                },
+            )
+            counter.increment()
+            events += 1
+    # only once the events are out, so a failed run reports them again
+    index.save(current)
+    LOGGER.info("Found %s changes to %s records", events, stream.tap_stream_id)
+    return events
+
+
+def reconcile(ctx):
+    config = ctx.config
+    directory = config.get("reconcile_index_dir")
+    if not directory:
+        raise Exception("reconcile_streams needs a reconcile_index_dir")
+    page_size = int(config.get("reconcile_page_size", DEFAULT_PAGE_SIZE))
+    detected_at = strftime(utils.now())
+    for tap_stream_id in config["reconcile_streams"]:
+        if tap_stream_id not in STATUS_FIELDS:
+            raise Exception(f"Reconciliation isn't supported for {tap_stream_id}")
+        index = StatusIndex(directory, config["tenant_id"], tap_stream_id)
+        stream = streams_by_id[tap_stream_id]
+        reconcile_stream(ctx, stream, index, page_size, detected_at)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import singer
+from .streams import _make_request, streams_by_id, sub_stream_ids
+
+LOGGER = singer.get_logger()
+
+DEFAULT_SNAPSHOT_TTL = 24 * 60 * 60
+# Substreams whose rows only carry the codes of the account, tax rate and item;
+# journal lines already come with names
+ENRICHED_STREAMS = sub_stream_ids - {"journals_lines"}
+# The fields enrich fills in, by the code they're looked up from
+ENRICHED_PROPERTIES = {
+    "AccountCode": {
+        "AccountID": {"type": ["null", "string"]},
+        "AccountName": {"type": ["null", "string"]},
+    },
+    "TaxType": {
+        "TaxName": {"type": ["null", "string"]},
+        "TaxRate": {"type": ["null", "number"]},
+    },
+    "ItemCode": {
+        "ItemID": {"type": ["null", "string"]},
+        "ItemName": {"type": ["null", "string"]},
+    },
+}
+
+
+def enriched_schema(schema):
+    """Adds the fields enrich fills in to a substream's schema, for the codes
+    its rows carry."""
+    properties = schema["properties"]
+    for code, fields in ENRICHED_PROPERTIES.items():
+        if code in properties:
+            for field, prop in fields.items():
+                properties.setdefault(field, dict(prop))
+    tracking = properties.get("Tracking")
+    if tracking:
+        tracking["properties"].setdefault(
+            "TrackingOptionID", {"type": ["null", "string"]}
+        )
+    return schema
+
+
+def _fetch(ctx, tap_stream_id):
+    records = _make_request(ctx, tap_stream_id) or []
+    formatted = streams_by_id[tap_stream_id].format_fn(records)
+    return records if formatted is None else formatted
+
+
+def _option_key(category_id, option_name):
+    # line items name their tracking option rather than giving its ID
+    return f"{category_id}|{option_name}"
+
+
+def _number(value):
+    return None if value is None else float(value)
+
+
+class ReferenceIndex:
+    """Accounts, tax rates, items and tracking options by the codes and names
+    that line items refer to them by, for filling in their IDs and names."""
+
+    def __init__(self, accounts, tax_rates, items, tracking_options):
+        self.accounts = accounts
+        self.tax_rates = tax_rates
+        self.items = items
+        self.tracking_options = tracking_options
+
+    @classmethod
+    def fetch(cls, ctx):
+        accounts = {
+            a["Code"]: {"AccountID": a["AccountID"], "AccountName": a.get("Name")}
+            for a in _fetch(ctx, "accounts")
+            if a.get("Code")
+        }
+        tax_rates = {
+            t["TaxType"]: {
+                "TaxName": t.get("Name"),
+                "TaxRate": _number(t.get("EffectiveRate")),
+            }
+            for t in _fetch(ctx, "tax_rates")
+        }
+        items = {
+            i["Code"]: {"ItemID": i["ItemID"], "ItemName": i.get("Name")}
+            for i in _fetch(ctx, "items")
+            if i.get("Code")
+        }
+        tracking_options = {}
+        for t in _fetch(ctx, "tracking_categories"):
+            key = _option_key(t["TrackingCategoryID"], t["TrackingOptionName"])
+            tracking_options[key] = t["TrackingOptionID"]
+        return cls(accounts, tax_rates, items, tracking_options)
+
+    @classmethod
+    def load(cls, ctx):
+        """Loads the tenant's snapshot from reference_snapshot_dir if there is
+        a fresh enough one, otherwise fetches the reference data and, with a
+        snapshot directory configured, saves it there."""
+        directory = ctx.config.get("reference_snapshot_dir")
+        path = None
+        if directory:
+            path = os.path.join(directory, ctx.config["tenant_id"] + ".json")
+            ttl = float(ctx.config.get("reference_snapshot_ttl", DEFAULT_SNAPSHOT_TTL))
+            if os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl:
+                with open(path) as f:
+                    return cls(**json.load(f))
+        index = cls.fetch(ctx)
+        LOGGER.info(
+            "Indexed %s accounts, %s tax rates, %s items and %s tracking options",
+            len(index.accounts),
+            len(index.tax_rates),
+            len(index.items),
+            len(index.tracking_options),
+        )
+        if path:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(vars(index), f)
+            os.replace(path + ".tmp", path)
+        return index
+
+    def enrich(self, row):
+        for key, index in (
+            ("AccountCode", self.accounts),
+            ("TaxType", self.tax_rates),
+            ("ItemCode", self.items),
+        ):
+            for field, value in index.get(row.get(key), {}).items():
+                if row.get(field) is None:
+                    row[field] = value
+        tracking = row.get("Tracking")
+        if tracking and not tracking.get("TrackingOptionID"):
+            option_id = self.tracking_options.get(
+                _option_key(tracking.get("TrackingCategoryID"), tracking.get("Option"))
+            )
+            if option_id:
+                # the tracking object is shared with the parent record
+                row["Tracking"] = {**tracking, "TrackingOptionID": option_id}
+        return row
+
+    def enrich_rows(self, sub_stream_id, rows):
+        if sub_stream_id not in ENRICHED_STREAMS:
+            return rows
+        return [self.enrich(row) for row in rows]
@@ -0,0 +1,417 @@
+import os
+import sys
+import gzip
+import json
+import time
+import tempfile
+import threading
+from collections import deque
+import singer
+from singer import metrics, utils
+from singer.utils import strptime_to_utc
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MAX_PART_BYTES = 128 * 1024 * 1024
+# Rows (by their JSON size) a parquet part holds in memory before writing them
+# out as a row group
+PARQUET_ROW_GROUP_BYTES = 16 * 1024 * 1024
+# Lines the writer thread takes off the spill file at a time
+SPILL_READ_BYTES = 1024 * 1024
+OUTPUT_METRICS_INTERVAL = 60
+EXPORT_FORMATS = ("jsonl", "parquet")
+
+
+class SingerSink:
+    """The default output: Singer messages on stdout, or on the given file."""
+
+    def __init__(self, out=None):
+        self.out = out
+
+    def write_message(self, message):
+        if self.out is None:
+            singer.write_message(message)
+        else:
+            self.out.write(singer.format_message(message) + "\n")
+
+    def write_schema(self, stream_id, schema, key_properties):
+        self.write_message(
+            singer.SchemaMessage(
+                stream=stream_id, schema=schema, key_properties=key_properties
+            )
+        )
+
+    def write_record(self, stream_id, record):
+        self.write_message(singer.RecordMessage(stream=stream_id, record=record))
+
+    def write_state(self, state):
+        self.write_message(singer.StateMessage(value=state))
+
+    def finish_stream(self, stream_id):
+        """Called once a stream's sync ends."""
+
+    def close(self):
+        pass
+
+
+class SpillQueue:
+    """A FIFO queue of output lines that holds up to max_bytes in memory and
+    spills the rest to a temporary file. Once spilling, new lines keep going
+    to the file until the reader has caught up with it, so lines always come
+    out in the order they went in."""
+
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.memory = deque()
+        self.memory_bytes = 0
+        self.spill = None
+        self.spill_read = 0
+        self.spill_write = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        # for the output metrics
+        self.depth = 0
+        self.max_depth = 0
+        self.spilled_bytes = 0
+        self.spills = 0
+
+    def put(self, line):
+        with self.cond:
+            if self.spill_write > self.spill_read or (
+                self.memory_bytes + len(line) > self.max_bytes and self.memory
+            ):
+                self._spill(line)
+            else:
+                self.memory.append(line)
+                self.memory_bytes += len(line)
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            self.cond.notify()
+
+    def _spill(self, line):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        if self.spill_write == self.spill_read:
+            self.spills += 1
+            LOGGER.info("Output is backed up, spilling to disk")
+        data = line.encode("utf-8")
+        self.spill.seek(self.spill_write)
+        self.spill.write(data)
+        self.spill_write += len(data)
+        self.spilled_bytes += len(data)
+
+    def get(self, timeout=None):
+        """Takes the next lines off the queue, waiting up to timeout for some.
+        Returns None once the queue is closed and empty."""
+        with self.cond:
+            if not self.memory and self.spill_write == self.spill_read:
+                if self.closed:
+                    return None
+                self.cond.wait(timeout)
+            if self.memory:
+                lines = list(self.memory)
+                self.memory.clear()
+                self.memory_bytes = 0
+            elif self.spill_write > self.spill_read:
+                self.spill.seek(self.spill_read)
+                lines = self.spill.readlines(SPILL_READ_BYTES)
+                self.spill_read += sum(len(line) for line in lines)
+                lines = [line.decode("utf-8") for line in lines]
+                if self.spill_read == self.spill_write:
+                    # caught up, so start again at the front of the file
+                    self.spill.truncate(0)
+                    self.spill_read = self.spill_write = 0
+            else:
+                return [] if not self.closed else None
+            self.depth -= len(lines)
+            return lines
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class BufferedSingerSink(SingerSink):
+    """Singer messages on stdout, written by a separate thread through a
+    SpillQueue, so a target that stops reading for a while (during a Redshift
+    COPY, say) doesn't hold up the sync and its open Xero connection."""
+
+    def __init__(self, max_buffer_bytes, spill_dir=None, out=None):
+        super().__init__(out or sys.stdout)
+        self.queue = SpillQueue(max_buffer_bytes, spill_dir)
+        self.error = None
+        self.last_metrics = time.monotonic()
+        self.writer = threading.Thread(target=self.write_lines, daemon=True)
+        self.writer.start()
+
+    def write_lines(self):
+        try:
+            while True:
+                lines = self.queue.get(timeout=OUTPUT_METRICS_INTERVAL)
+                if lines is None:
+                    return
+                self.out.write("".join(lines))
+                self.out.flush()
+                if time.monotonic() - self.last_metrics >= OUTPUT_METRICS_INTERVAL:
+                    self.log_metrics()
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+
+    def log_metrics(self):
+        self.last_metrics = time.monotonic()
+        queue = self.queue
+        for name, value in (
+            ("output_queue_depth", queue.depth),
+            ("output_queue_max_depth", queue.max_depth),
+            ("output_spilled_bytes", queue.spilled_bytes),
+            ("output_spills", queue.spills),
+        ):
+            metrics.log(LOGGER, metrics.Point("gauge", name, value, {}))
+
+    def write_message(self, message):
+        if self.error:
+            raise Exception("Writing output failed") from self.error
+        self.queue.put(singer.format_message(message) + "\n")
+
+    def close(self):
+        self.queue.close()
+        self.writer.join()
+        self.log_metrics()
+        if self.error:
+            raise Exception("Writing output failed") from self.error
+
+
+def _json_default(value):
+    # Decimals that weren't coerced by the transformer still need to be written
+    return float(value)
+
+
+class JsonlPartWriter:
+    extension = "jsonl.gz"
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, record):
+        line = json.dumps(record, default=_json_default) + "\n"
+        self.file.write(line)
+        return len(line)
+
+    def close(self):
+        self.file.close()
+
+
+def _arrow_field_type(pa, prop):
+    types = prop.get("type", [])
+    types = [t for t in (types if isinstance(types, list) else [types]) if t != "null"]
+    if prop.get("format") == "date-time":
+        return pa.timestamp("us", tz="UTC")
+    if types == ["integer"]:
+        return pa.int64()
+    if types == ["number"]:
+        return pa.float64()
+    if types == ["boolean"]:
+        return pa.bool_()
+    # strings, plus nested objects and arrays which are written JSON-encoded
+    return pa.string()
+
+
+def _to_text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=_json_default)
+
+
+class ParquetPartWriter:
+    extension = "parquet"
+
+    def __init__(self, path, schema):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise Exception(
+                "export_format 'parquet' requires the pyarrow package to be installed"
+            ) from e
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        properties = schema.get("properties", {})
+        self.columns = list(properties.keys())
+        self.arrow_schema = pa.schema(
+            [(name, _arrow_field_type(pa, properties[name])) for name in self.columns]
+        )
+        self.converters = {}
+        for name in self.columns:
+            field_type = self.arrow_schema.field(name).type
+            if pa.types.is_timestamp(field_type):
+                self.converters[name] = strptime_to_utc
+            elif pa.types.is_string(field_type):
+                self.converters[name] = _to_text
+        self.writer = pq.ParquetWriter(path, self.arrow_schema, compression="snappy")
+        self.rows = {name: [] for name in self.columns}
+        self.buffered = 0
+
+    def write(self, record):
+        for name in self.columns:
+            value = record.get(name)
+            if value is not None and name in self.converters:
+                value = self.converters[name](value)
+            self.rows[name].append(value)
+        size = len(json.dumps(record, default=_json_default))
+        self.buffered += size
+        if self.buffered >= PARQUET_ROW_GROUP_BYTES:
+            self.write_row_group()
+        return size
+
+    def write_row_group(self):
+        table = self.pa.Table.from_pydict(self.rows, schema=self.arrow_schema)
+        self.writer.write_table(table)
+        self.rows = {name: [] for name in self.columns}
+        self.buffered = 0
+
+    def close(self):
+        if self.buffered:
+            self.write_row_group()
+        self.writer.close()
+
+
+class StreamExport:
+    def __init__(self, directory, stream_id, schema, key_properties, writer_cls):
+        self.directory = os.path.join(directory, stream_id)
+        self.stream_id = stream_id
+        self.schema = schema
+        self.key_properties = key_properties
+        self.writer_cls = writer_cls
+        self.parts = []
+        self.writer = None
+        self.part_records = 0
+        self.part_bytes = 0
+
+    def write(self, record, max_part_bytes):
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory,
+                "part-{:05d}.{}".format(len(self.parts), self.writer_cls.extension),
+            )
+            self.writer = self.writer_cls(path, self.schema)
+        self.part_bytes += self.writer.write(record)
+        self.part_records += 1
+        if self.part_bytes >= max_part_bytes:
+            self.finish_part()
+
+    def finish_part(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.parts.append(
+            {
+                "path": self.writer.path,
+                "records": self.part_records,
+                "content_length": os.path.getsize(self.writer.path),
+            }
+        )
+        self.writer = None
+        self.part_records = 0
+        self.part_bytes = 0
+
+
+class BatchExportSink:
+    """Writes records straight to compressed, size-bounded part files per
+    stream instead of Singer messages on stdout. Each run writes to a
+    directory of its own, named for when it started, under the given one, so
+    one run's parts and manifests never overwrite another's. On close it
+    writes a manifest, a Redshift COPY manifest per stream and the final
+    state, then emits that state on stdout so the orchestrator can still
+    persist it. Intermediate states are held back, as they may refer to
+    records in part files that haven't been closed yet."""
+
+    def __init__(self, directory, export_format="jsonl", max_part_bytes=None):
+        if export_format not in EXPORT_FORMATS:
+            raise Exception(
+                "export_format must be one of {}".format(", ".join(EXPORT_FORMATS))
+            )
+        self.directory = os.path.join(
+            directory, utils.now().strftime("%Y%m%dT%H%M%S%fZ")
+        )
+        self.export_format = export_format
+        self.writer_cls = (
+            ParquetPartWriter if export_format == "parquet" else JsonlPartWriter
+        )
+        self.max_part_bytes = max_part_bytes or DEFAULT_MAX_PART_BYTES
+        self.streams = {}
+        self.state = None
+
+    def write_schema(self, stream_id, schema, key_properties):
+        if stream_id not in self.streams:
+            self.streams[stream_id] = StreamExport(
+                self.directory, stream_id, schema, key_properties, self.writer_cls
+            )
+
+    def write_record(self, stream_id, record):
+        self.streams[stream_id].write(record, self.max_part_bytes)
+
+    def write_state(self, state):
+        # Copy, as the context keeps mutating its state dict
+        self.state = json.loads(json.dumps(state))
+
+    def finish_stream(self, stream_id):
+        # Close the stream's open part now rather than holding it, and the
+        # rows a parquet part buffers, until the whole run ends
+        if stream_id in self.streams:
+            self.streams[stream_id].finish_part()
+
+    def close(self):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {"format": self.export_format, "streams": {}, "state": self.state}
+        for stream_id, export in self.streams.items():
+            export.finish_part()
+            manifest["streams"][stream_id] = {
+                "key_properties": export.key_properties,
+                "schema": export.schema,
+                "records": sum(part["records"] for part in export.parts),
+                "parts": export.parts,
+            }
+            if export.parts:
+                _write_json(
+                    os.path.join(export.directory, "copy_manifest.json"),
+                    {
+                        "entries": [
+                            {
+                                "url": os.path.abspath(part["path"]),
+                                "mandatory": True,
+                                "meta": {"content_length": part["content_length"]},
+                            }
+                            for part in export.parts
+                        ]
+                    },
+                )
+        _write_json(os.path.join(self.directory, "manifest.json"), manifest)
+        _write_json(os.path.join(self.directory, "state.json"), self.state or {})
+        LOGGER.info("Wrote batch export manifest to %s", self.directory)
+        if self.state is not None:
+            singer.write_state(self.state)
+
+
+def _write_json(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f, indent=2)
+
+
+def sink_from_config(config):
+    directory = config.get("export_dir")
+    if not directory:
+        if config.get("output_buffer_bytes"):
+            return BufferedSingerSink(
+                int(config["output_buffer_bytes"]), config.get("output_spill_dir")
+            )
+        return SingerSink()
+    return BatchExportSink(
+        directory,
+        export_format=config.get("export_format", "jsonl"),
+        max_part_bytes=int(config.get("export_max_part_bytes", DEFAULT_MAX_PART_BYTES)),
+    )
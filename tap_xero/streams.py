@@ -1,18 +1,38 @@
 import time
 import json
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from requests.exceptions import HTTPError
 import singer
-from singer import metadata, metrics, Transformer
-from singer.utils import strptime_with_tz
+from singer import metrics
+from singer.utils import strftime, strptime_to_utc, strptime_with_tz
 from . import transform
 
 LOGGER = singer.get_logger()
 FULL_PAGE_SIZE = 100
 
 
-def _make_request(ctx, tap_stream_id, filter_options=None, attempts=0):
+class StopRun(Exception):
+    """Ends the run early but cleanly, leaving the state at the last
+    checkpoint for the next run to resume from."""
+
+
+class DailyRateLimitExceeded(StopRun):
+    pass
+
+
+class DeadlineReached(StopRun):
+    pass
+
+
+def _make_request(ctx, tap_stream_id, filter_options=None, attempts=0, raw=False):
     filter_options = filter_options or {}
+    if ctx.past_deadline():
+        raise DeadlineReached("Not starting any more requests before max_runtime")
     try:
+        if raw:
+            return ctx.client.fetch_raw(tap_stream_id, **filter_options)
         return ctx.client.fetch(tap_stream_id, **filter_options)
     except HTTPError as e:
         if e.response.status_code == 401:
@@ -20,30 +40,38 @@ def _make_request(ctx, tap_stream_id, filter_options=None, attempts=0):
                 raise Exception(
                     "Received Not Authorized response after credential refresh."
                 ) from e
-            ctx.refresh_credentials()
-            return _make_request(ctx, tap_stream_id, filter_options, attempts + 1)
+            ctx.refresh_credentials(force=True)
+            return _make_request(
+                ctx, tap_stream_id, filter_options, attempts + 1, raw
+            )
         elif e.response.status_code == 429 or e.response.status_code == 503:
             if attempts >= 5:
                 raise Exception(
                     "Still rate-limited after waiting for the retry period multiple times."
                 ) from e
             wait = float(e.response.headers["Retry-After"])
-            if wait > 60:
-                raise Exception(
+            if wait > 60 or e.response.headers.get("X-Rate-Limit-Problem") == "day":
+                raise DailyRateLimitExceeded(
                     f"Wait of {wait}s is over 60s so have hit daily rate limit"
                 ) from e
+            if ctx.past_deadline(wait):
+                raise DeadlineReached(
+                    f"Waiting {wait}s for the rate limit would overrun max_runtime"
+                ) from e
             LOGGER.info(f"Waiting for rate limit: {wait}")
+            if ctx.telemetry:
+                ctx.telemetry.rate_limited(tap_stream_id, wait)
             time.sleep(wait)
-            return _make_request(ctx, tap_stream_id, filter_options, attempts + 1)
+            return _make_request(
+                ctx, tap_stream_id, filter_options, attempts + 1, raw
+            )
         else:
             raise
     assert False
 
 
-def write_sub_records(
-    ctx, parent_pk, sub, records, id_key=None, parent_key="LineItems"
-):
-    rows = [
+def line_item_rows(parent, parent_pk, id_key=None, parent_key="LineItems"):
+    return [
         {
             **row,
             "ParentID": parent[parent_pk],
@@ -56,10 +84,30 @@ def write_sub_records(
             "Description": json.dumps(row.get("Description")),
             "Tracking": row["Tracking"][0] if row["Tracking"] else None,
         }
-        for parent in records
         for (row_index, row) in enumerate(parent[parent_key])
     ]
-    sub.write_records(rows, ctx)
+
+
+def sub_parent_key(tap_stream_id):
+    """The key on a parent record that holds its substream rows."""
+    if tap_stream_id in ("journals", "manual_journals"):
+        return "JournalLines"
+    return "LineItems"
+
+
+def xero_datetime(value):
+    """Formats an RFC3339 string as a DateTime() for Xero's where filters."""
+    dt = strptime_with_tz(value)
+    return dt.strftime("DateTime(%Y, %m, %d, %H, %M, %S)")
+
+
+def overlap_start(ctx, start):
+    """Moves a bookmark back by bookmark_overlap_seconds, so records stamped by
+    a Xero clock running slightly behind are read again rather than missed."""
+    overlap = float(ctx.config.get("bookmark_overlap_seconds") or 0)
+    if not overlap:
+        return start
+    return strftime(strptime_to_utc(start) - timedelta(seconds=overlap))
 
 
 class Stream:
@@ -72,71 +120,298 @@ class Stream:
         self.bookmark_key = bookmark_key
         self.replication_method = "INCREMENTAL"
 
+    def sub_rows(self, parent):
+        return line_item_rows(parent, self.pk_fields[0])
+
     def metrics(self, records):
         with metrics.record_counter(self.tap_stream_id) as counter:
             counter.increment(len(records))
 
-    def write_records(self, records, ctx):
-        stream = ctx.catalog.get_stream(self.tap_stream_id)
-        schema = stream.schema.to_dict()
-        mdata = stream.metadata
-        for rec in records:
-            with Transformer() as transformer:
-                rec = transformer.transform(rec, schema, metadata.to_map(mdata))
-                singer.write_record(self.tap_stream_id, rec)
+    def count_written(self, records, ctx):
+        ctx.records_written += len(records)
         self.metrics(records)
+        if ctx.telemetry:
+            ctx.telemetry.records_written(self, records)
+
+    def write_entries(self, records, ctx, sub, transform, progress=None):
+        """Writes each record followed by its substream rows, as returned by
+        transform(record), so a failure partway through leaves whole records
+        written. Records already written at the same version are skipped with
+        dedup on; with progress, so are the records it says were written
+        before, and it counts each record as it's written."""
+        start = progress.start(self, records) if progress else 0
+        written, rows_written = [], []
+        try:
+            for record in records[start:]:
+                parent, rows = transform(record)
+                if not ctx.dedup or ctx.dedup.is_new(self, record):
+                    ctx.sink.write_record(self.tap_stream_id, parent)
+                    for row in rows:
+                        ctx.sink.write_record(sub.tap_stream_id, row)
+                    if ctx.dedup:
+                        ctx.dedup.add(self, record)
+                    written.append(parent)
+                    rows_written += rows
+                if progress:
+                    progress.advance(self, record)
+        finally:
+            self.count_written(written, ctx)
+            if sub:
+                sub.count_written(rows_written, ctx)
+
+    def write_page(self, records, ctx, sub=None, progress=None):
+        """Formats, transforms and writes a page of records along with their
+        substream rows, returning the formatted records."""
+        formatted = self.format_fn(records)
+        records = records if formatted is None else formatted
+        transformer = ctx.record_transformer(self.tap_stream_id)
+        if sub:
+            sub_transformer = ctx.record_transformer(sub.tap_stream_id)
+            reference = ctx.reference_index()
+
+        def transform(record):
+            rows = []
+            if sub:
+                rows = self.sub_rows(record)
+                if reference:
+                    rows = reference.enrich_rows(sub.tap_stream_id, rows)
+                rows = [sub_transformer.transform(row) for row in rows]
+            return transformer.transform(record), rows
+
+        self.write_entries(records, ctx, sub, transform, progress)
+        return records
+
+    def write_decoded(self, page, ctx, sub=None, progress=None):
+        """Writes a page that a decode worker has already transformed."""
+        rows_by_parent = defaultdict(list)
+        for row in page.sub_records:
+            rows_by_parent[row["ParentID"]].append(row)
+
+        def transform(record):
+            return record, rows_by_parent[record[self.pk_fields[0]]]
+
+        self.write_entries(page.records, ctx, sub, transform, progress)
+
+    def high_water(self, current, records):
+        """The later of the current bookmark and the latest in records."""
+        latest = max(record[self.bookmark_key] for record in records)
+        if current and strptime_to_utc(current) >= strptime_to_utc(latest):
+            return current
+        return latest
+
+
+class PageProgress:
+    """How many of the current page's records have been written, and the ID of
+    the last, saved with a stream's offsets so that a sync which fails partway
+    through a page resumes after the last record written rather than writing
+    the whole page again."""
+
+    def __init__(self, written=0, last_id=None):
+        self.written = written
+        self.last_id = last_id
+
+    @classmethod
+    def load(cls, ctx, tap_stream_id):
+        return cls(
+            ctx.get_offset([tap_stream_id, "record"]) or 0,
+            ctx.get_offset([tap_stream_id, "record_id"]),
+        )
+
+    def save(self, ctx, tap_stream_id):
+        if self.written:
+            ctx.set_offset([tap_stream_id, "record"], self.written)
+            ctx.set_offset([tap_stream_id, "record_id"], self.last_id)
+        else:
+            ctx.remove_offset([tap_stream_id, "record"])
+            ctx.remove_offset([tap_stream_id, "record_id"])
+
+    def start(self, stream, records):
+        """The index of the first record on the page not yet written. Looked
+        up by ID when the page has shifted since, e.g. because records on it
+        were updated; if the last record written has gone from the page
+        altogether, the whole page is written again."""
+        if not self.written:
+            return 0
+        pk = stream.pk_fields[0]
+        if len(records) < self.written or records[self.written - 1][pk] != self.last_id:
+            ids = [record[pk] for record in records]
+            if self.last_id in ids:
+                self.written = ids.index(self.last_id) + 1
+            else:
+                LOGGER.warning(
+                    "Record %s is no longer on the %s page being resumed, so "
+                    "writing the whole page again",
+                    self.last_id,
+                    stream.tap_stream_id,
+                )
+                self.next_page()
+        return self.written
+
+    def advance(self, stream, record):
+        self.written += 1
+        self.last_id = record[stream.pk_fields[0]]
+
+    def next_page(self):
+        self.written = 0
+        self.last_id = None
 
 
 class BookmarkedStream(Stream):
     def sync(self, ctx, sub=None):
         bookmark = [self.tap_stream_id, self.bookmark_key]
         start = ctx.get_bookmark(bookmark)
-        records = _make_request(ctx, self.tap_stream_id, dict(since=start))
+        records = _make_request(
+            ctx, self.tap_stream_id, dict(since=overlap_start(ctx, start))
+        )
         if records:
-            self.format_fn(records)
-            self.write_records(records, ctx)
-            if sub:
-                write_sub_records(ctx, self.pk_fields[0], sub, records)
-            max_bookmark_value = max([record[self.bookmark_key] for record in records])
-            ctx.set_bookmark(bookmark, max_bookmark_value)
+            records = self.write_page(records, ctx, sub)
+            ctx.set_bookmark(bookmark, self.high_water(start, records))
             ctx.write_state()
 
 
 class PaginatedStream(Stream):
+    def sub_rows(self, parent):
+        stream_id = self.tap_stream_id
+        return line_item_rows(
+            parent,
+            self.pk_fields[0],
+            id_key="LineItemID" if stream_id == "invoices" else None,
+            parent_key=sub_parent_key(stream_id),
+        )
+
+    def resume_point(self, ctx):
+        """The If-Modified-Since and page to sync from: where an interrupted
+        sync left off, or else page 1 from the bookmark less any overlap."""
+        page = ctx.get_offset([self.tap_stream_id, "page"])
+        start = ctx.get_bookmark([self.tap_stream_id, self.bookmark_key])
+        ctx.client.set_resuming(self.tap_stream_id, bool(page))
+        if page:
+            # offsets from before the since was saved with them were paging
+            # from the bookmark, which stayed put until the stream finished
+            return ctx.get_offset([self.tap_stream_id, "since"]) or start, page
+        return overlap_start(ctx, start), 1
+
+    def checkpoint(self, ctx, page_num, since, max_updated, progress):
+        """Saves the page and record to resume from and the bookmark reached
+        so far. The pages are in UpdatedDateUTC order, so everything before
+        max_updated has been written."""
+        ctx.set_offset([self.tap_stream_id, "page"], page_num)
+        ctx.set_offset([self.tap_stream_id, "since"], since)
+        progress.save(ctx, self.tap_stream_id)
+        ctx.set_bookmark([self.tap_stream_id, self.bookmark_key], max_updated)
+        ctx.write_state()
+
+    def finish(self, ctx, max_updated):
+        ctx.clear_offsets(self.tap_stream_id)
+        ctx.set_bookmark([self.tap_stream_id, self.bookmark_key], max_updated)
+        ctx.write_state()
+
     def sync(self, ctx, sub=None):
-        bookmark = [self.tap_stream_id, self.bookmark_key]
-        offset = [self.tap_stream_id, "page"]
-        start = ctx.get_bookmark(bookmark)
-        curr_page_num = ctx.get_offset(offset) or 1
-        filter_options = dict(since=start)
-        max_updated = start
+        if ctx.get_decode_pool():
+            self.sync_pooled(ctx, sub)
+            return
+        since, curr_page_num = self.resume_point(ctx)
+        filter_options = dict(since=since, order=f"{self.bookmark_key} ASC")
+        max_updated = ctx.get_bookmark([self.tap_stream_id, self.bookmark_key])
+        progress = PageProgress.load(ctx, self.tap_stream_id)
         while True:
-            ctx.set_offset(offset, curr_page_num)
-            ctx.write_state()
+            self.checkpoint(ctx, curr_page_num, since, max_updated, progress)
             filter_options["page"] = curr_page_num
             records = _make_request(ctx, self.tap_stream_id, filter_options)
             if records:
-                self.format_fn(records)
-                self.write_records(records, ctx)
-                if sub:
-                    stream_id = self.tap_stream_id
-                    write_sub_records(
-                        ctx,
-                        self.pk_fields[0],
-                        sub,
-                        records,
-                        id_key="LineItemID" if stream_id == "invoices" else None,
-                        parent_key="JournalLines"
-                        if stream_id == "manual_journals"
-                        else "LineItems",
-                    )
-                max_updated = records[-1][self.bookmark_key]
+                try:
+                    records = self.write_page(records, ctx, sub, progress)
+                except BaseException:
+                    self.checkpoint(ctx, curr_page_num, since, max_updated, progress)
+                    raise
+                max_updated = self.high_water(max_updated, records)
             if not records or len(records) < FULL_PAGE_SIZE:
                 break
             curr_page_num += 1
-        ctx.clear_offsets(self.tap_stream_id)
-        ctx.set_bookmark(bookmark, max_updated)
-        ctx.write_state()
+            progress.next_page()
+        self.finish(ctx, max_updated)
+
+    def fetch_decoded(self, ctx, sub, filter_options):
+        """Fetches a page and hands it to the decode pool, returning the future
+        of the decoded page."""
+        text = _make_request(ctx, self.tap_stream_id, filter_options, raw=True)
+        return ctx.get_decode_pool().submit(self.tap_stream_id, sub, text)
+
+    def sync_pooled(self, ctx, sub=None):
+        """Same paging and checkpoints as sync, but pages are fetched on
+        threads, as many at a time as the client's concurrency controller
+        allows, and decoded by the decode pool. Pages are written strictly in
+        order. Once a full page has come back, pages are requested ahead, up to
+        the pool's workers or the requests allowed in flight if that's more,
+        so the last page of a stream can cost that many extra (empty)
+        requests."""
+        pool = ctx.get_decode_pool()
+        concurrency = ctx.client.concurrency
+        since, next_page_num = self.resume_point(ctx)
+        max_updated = ctx.get_bookmark([self.tap_stream_id, self.bookmark_key])
+        in_flight = deque()
+        read_ahead = False
+        progress = PageProgress.load(ctx, self.tap_stream_id)
+        self.checkpoint(ctx, next_page_num, since, max_updated, progress)
+        with ThreadPoolExecutor(concurrency.max_limit) as fetcher:
+            try:
+                while True:
+                    ahead = max(pool.workers, concurrency.allowed())
+                    while not in_flight or (read_ahead and len(in_flight) < ahead):
+                        filter_options = dict(
+                            since=since,
+                            order=f"{self.bookmark_key} ASC",
+                            page=next_page_num,
+                        )
+                        fetched = fetcher.submit(
+                            self.fetch_decoded, ctx, sub, filter_options
+                        )
+                        in_flight.append((next_page_num, fetched))
+                        next_page_num += 1
+                    page_num, fetched = in_flight.popleft()
+                    # a StopRun fetching this page stops the sync here, with
+                    # the pages before it written
+                    page = fetched.result().result()
+                    if page.records:
+                        try:
+                            self.write_decoded(page, ctx, sub, progress)
+                        except BaseException:
+                            self.checkpoint(ctx, page_num, since, max_updated, progress)
+                            raise
+                        max_updated = self.high_water(
+                            max_updated, [{self.bookmark_key: page.max_bookmark}]
+                        )
+                    if len(page.records) < FULL_PAGE_SIZE:
+                        break
+                    progress.next_page()
+                    self.checkpoint(ctx, page_num + 1, since, max_updated, progress)
+                    read_ahead = True
+            finally:
+                # anything requested beyond the last page is empty
+                for _, pending in in_flight:
+                    pending.cancel()
+        self.finish(ctx, max_updated)
+
+    def sync_window(self, ctx, sub, start, end=None):
+        """Syncs just the records updated in [start, end), for distributed runs
+        that split a stream into date windows. Doesn't touch the bookmark;
+        returns the greatest UpdatedDateUTC seen, if any."""
+        where = f"{self.bookmark_key}>={xero_datetime(start)}"
+        if end:
+            where += f" AND {self.bookmark_key}<{xero_datetime(end)}"
+        filter_options = {"where": where, "order": f"{self.bookmark_key} ASC"}
+        max_updated = None
+        page_num = 1
+        while True:
+            filter_options["page"] = page_num
+            records = _make_request(ctx, self.tap_stream_id, filter_options)
+            if records:
+                records = self.write_page(records, ctx, sub)
+                max_updated = self.high_water(max_updated, records)
+            if not records or len(records) < FULL_PAGE_SIZE:
+                break
+            page_num += 1
+        return max_updated
 
 
 class Journals(Stream):
@@ -144,6 +419,20 @@ class Journals(Stream):
     and paging the data. See
     https://developer.xero.com/documentation/api/journals"""
 
+    def sub_rows(self, parent):
+        return [
+            {
+                **row,
+                "JournalID": parent["JournalID"],
+                # Have to JSON-encode so linebreaks aren't stripped out by Redshift loader
+                "Description": json.dumps(row.get("Description")),
+                "Tracking": row["TrackingCategories"][0]
+                if row["TrackingCategories"]
+                else None,
+            }
+            for row in parent["JournalLines"]
+        ]
+
     def sync(self, ctx, sub=None):
         bookmark = [self.tap_stream_id, self.bookmark_key]
         journal_number = ctx.get_bookmark(bookmark) or 0
@@ -151,29 +440,43 @@ class Journals(Stream):
             filter_options = {"offset": journal_number}
             records = _make_request(ctx, self.tap_stream_id, filter_options)
             if records:
-                self.format_fn(records)
-                self.write_records(records, ctx)
-                if sub:
-                    rows = [
-                        {
-                            **row,
-                            "JournalID": parent["JournalID"],
-                            # Have to JSON-encode so linebreaks aren't stripped out by Redshift loader
-                            "Description": json.dumps(row.get("Description")),
-                            "Tracking": row["TrackingCategories"][0]
-                            if row["TrackingCategories"]
-                            else None,
-                        }
-                        for parent in records
-                        for row in parent["JournalLines"]
-                    ]
-                    sub.write_records(rows, ctx)
+                progress = PageProgress()
+                try:
+                    self.write_page(records, ctx, sub, progress)
+                except BaseException:
+                    # journals come in JournalNumber order, so the number of
+                    # the last one written is where to carry on from
+                    if progress.written:
+                        last = records[progress.written - 1][self.bookmark_key]
+                        ctx.set_bookmark(bookmark, last)
+                        ctx.write_state()
+                    raise
                 journal_number = max((record[self.bookmark_key] for record in records))
                 ctx.set_bookmark(bookmark, journal_number)
                 ctx.write_state()
             if not records or len(records) < FULL_PAGE_SIZE:
                 break
 
+    def sync_window(self, ctx, sub, start, end=None):
+        """Syncs just the journals numbered after start up to and including
+        end, for distributed runs that split the stream into ranges of
+        JournalNumber. Doesn't touch the bookmark; returns the greatest
+        JournalNumber written, if any."""
+        journal_number = start
+        max_number = None
+        while True:
+            filter_options = {"offset": journal_number}
+            records = _make_request(ctx, self.tap_stream_id, filter_options)
+            if end is not None:
+                records = [r for r in records if r[self.bookmark_key] <= end]
+            if records:
+                self.write_page(records, ctx, sub)
+                journal_number = max(r[self.bookmark_key] for r in records)
+                max_number = journal_number
+            if len(records) < FULL_PAGE_SIZE or journal_number == end:
+                break
+        return max_number
+
 
 class LinkedTransactions(Stream):
     """The Linked Transactions endpoint is a special case. It supports
@@ -187,10 +490,13 @@ class LinkedTransactions(Stream):
         offset = [self.tap_stream_id, "page"]
         # start = ctx.update_start_date_bookmark(bookmark)
         start = ctx.get_bookmark(bookmark)
+        ctx.client.set_resuming(self.tap_stream_id, bool(ctx.get_offset(offset)))
         curr_page_num = ctx.get_offset(offset) or 1
+        progress = PageProgress.load(ctx, self.tap_stream_id)
         max_updated = start
         while True:
             ctx.set_offset(offset, curr_page_num)
+            progress.save(ctx, self.tap_stream_id)
             ctx.write_state()
             filter_options = {"page": curr_page_num}
             raw_records = _make_request(ctx, self.tap_stream_id, filter_options)
@@ -200,11 +506,17 @@ class LinkedTransactions(Stream):
                 if strptime_with_tz(x[self.bookmark_key]) >= strptime_with_tz(start)
             ]
             if records:
-                self.write_records(records, ctx)
+                try:
+                    self.write_page(records, ctx, progress=progress)
+                except BaseException:
+                    progress.save(ctx, self.tap_stream_id)
+                    ctx.write_state()
+                    raise
                 max_updated = records[-1][self.bookmark_key]
             if not records or len(records) < FULL_PAGE_SIZE:
                 break
             curr_page_num += 1
+            progress.next_page()
         ctx.clear_offsets(self.tap_stream_id)
         ctx.set_bookmark(bookmark, max_updated)
         ctx.write_state()
@@ -218,10 +530,7 @@ class Everything(Stream):
 
     def sync(self, ctx, sub=None):
         records = _make_request(ctx, self.tap_stream_id)
-        transformed = self.format_fn(records)
-        self.write_records(records if transformed is None else transformed, ctx)
-        if sub:
-            write_sub_records(ctx, self.pk_fields[0], sub, records)
+        self.write_page(records, ctx, sub)
 
 
 class SubStream(Stream):
@@ -302,6 +611,8 @@ all_streams = [
 ]
 all_stream_ids = [s.tap_stream_id for s in all_streams]
 
+streams_by_id = {s.tap_stream_id: s for s in all_streams}
+
 sub_stream_suffix = "_lines"
 sub_stream_ids = {s for s in all_stream_ids if s.endswith(sub_stream_suffix)}
 has_sub_stream_ids = {
@@ -0,0 +1,149 @@
+import os
+import time
+from collections import defaultdict
+import singer
+from singer import metrics, utils
+from singer.utils import strptime_to_utc
+
+LOGGER = singer.get_logger()
+
+DEFAULT_INTERVAL = 60
+# The field freshness is measured on, where it isn't the stream's bookmark
+FRESHNESS_FIELDS = {"journals": "CreatedDateUTC", "journals_lines": None}
+
+
+class StreamTelemetry:
+    def __init__(self):
+        self.records = 0
+        self.newest = None
+        self.rate_limited_seconds = 0.0
+        # totals at the last flush, for the per-interval rates
+        self.flushed_records = 0
+        self.flushed_bytes = 0
+
+
+class Telemetry:
+    """Throughput, API usage and freshness per stream, written every interval
+    seconds (checked as pages are written) and at the end of the run, to a
+    Prometheus textfile for node_exporter's textfile collector and/or as
+    singer metric log lines."""
+
+    def __init__(
+        self,
+        client,
+        tenant_id,
+        textfile=None,
+        singer_metrics=False,
+        interval=DEFAULT_INTERVAL,
+    ):
+        self.client = client
+        self.tenant_id = tenant_id
+        self.textfile = textfile
+        self.singer_metrics = singer_metrics
+        self.interval = interval
+        self.streams = defaultdict(StreamTelemetry)
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config, client):
+        textfile = config.get("metrics_textfile")
+        singer_metrics = bool(config.get("metrics_singer"))
+        if not textfile and not singer_metrics:
+            return None
+        return cls(
+            client,
+            config.get("tenant_id"),
+            textfile=textfile,
+            singer_metrics=singer_metrics,
+            interval=float(config.get("metrics_interval", DEFAULT_INTERVAL)),
+        )
+
+    def records_written(self, stream, records):
+        telemetry = self.streams[stream.tap_stream_id]
+        telemetry.records += len(records)
+        field = FRESHNESS_FIELDS.get(stream.tap_stream_id, stream.bookmark_key)
+        values = [r[field] for r in records if r.get(field)] if field else []
+        if values:
+            newest = strptime_to_utc(max(values))
+            if telemetry.newest is None or newest > telemetry.newest:
+                telemetry.newest = newest
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def rate_limited(self, tap_stream_id, seconds):
+        self.streams[tap_stream_id].rate_limited_seconds += seconds
+
+    def samples(self):
+        """(metric, labels, value) for every metric."""
+        elapsed = max(time.monotonic() - self.last_flush, 1e-6)
+        now = utils.now()
+        tenant = {"tenant": self.tenant_id}
+        usage = self.client.stream_usage
+        samples = [("tap_xero_api_calls_total", tenant, self.client.calls)]
+        remaining = self.client.day_limit_remaining
+        if remaining is not None:
+            samples.append(("tap_xero_api_calls_remaining", tenant, remaining))
+        concurrency = self.client.concurrency
+        samples += [
+            ("tap_xero_concurrency_limit", tenant, concurrency.allowed()),
+            ("tap_xero_requests_in_flight", tenant, concurrency.in_flight),
+            ("tap_xero_concurrency_decreases_total", tenant, concurrency.decreases),
+        ]
+        for tap_stream_id in sorted(set(self.streams) | set(usage)):
+            telemetry = self.streams[tap_stream_id]
+            stream_usage = usage.get(tap_stream_id, {"calls": 0, "bytes": 0})
+            labels = {**tenant, "stream": tap_stream_id}
+            samples += [
+                ("tap_xero_records_total", labels, telemetry.records),
+                (
+                    "tap_xero_records_per_second",
+                    labels,
+                    (telemetry.records - telemetry.flushed_records) / elapsed,
+                ),
+                ("tap_xero_bytes_total", labels, stream_usage["bytes"]),
+                (
+                    "tap_xero_bytes_per_second",
+                    labels,
+                    (stream_usage["bytes"] - telemetry.flushed_bytes) / elapsed,
+                ),
+                ("tap_xero_stream_api_calls_total", labels, stream_usage["calls"]),
+                (
+                    "tap_xero_rate_limited_seconds_total",
+                    labels,
+                    telemetry.rate_limited_seconds,
+                ),
+            ]
+            if telemetry.newest is not None:
+                lag = (now - telemetry.newest).total_seconds()
+                samples.append(("tap_xero_freshness_lag_seconds", labels, lag))
+        return samples
+
+    def flush(self):
+        samples = self.samples()
+        if self.textfile:
+            self.write_textfile(samples)
+        if self.singer_metrics:
+            for name, labels, value in samples:
+                metrics.log(LOGGER, metrics.Point("gauge", name, value, labels))
+        for tap_stream_id, telemetry in self.streams.items():
+            telemetry.flushed_records = telemetry.records
+            usage = self.client.stream_usage.get(tap_stream_id)
+            telemetry.flushed_bytes = usage["bytes"] if usage else 0
+        self.last_flush = time.monotonic()
+
+    def write_textfile(self, samples):
+        lines = []
+        typed = set()
+        # each metric's samples have to be together in the file
+        for name, labels, value in sorted(samples, key=lambda s: s[0]):
+            if name not in typed:
+                kind = "counter" if name.endswith("_total") else "gauge"
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+        # written whole and renamed, so the collector never reads half a file
+        tmp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.textfile)
@@ -0,0 +1,227 @@
+import re
+from singer import metadata, Transformer
+from singer.transform import string_to_datetime
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_FULL_RECORDS = 1000
+DEFAULT_SAMPLE_EVERY = 100
+# The form the decoder normalises Xero dates to, which the Transformer would
+# parse and format back to the same string
+CANONICAL_DATE_TIME = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}Z$")
+
+
+class FastPathMiss(Exception):
+    """A value the fast path can't coerce cheaply; the record goes through
+    the full Transformer instead."""
+
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+def _types(schema):
+    types = schema.get("type", [])
+    return types if isinstance(types, list) else [types]
+
+
+def _compile(schema):
+    """Compiles a schema into a converter that reproduces what the Transformer
+    would output for well-formed data, raising FastPathMiss for anything
+    else."""
+    if "anyOf" in schema or "patternProperties" in schema:
+        raise UnsupportedSchema()
+    if "type" not in schema:
+        return lambda value: value
+
+    types = _types(schema)
+    nullable = "null" in types
+    types = [t for t in types if t != "null"]
+    if len(types) != 1:
+        raise UnsupportedSchema()
+    typ = types[0]
+
+    if schema.get("format") == "date-time":
+        convert = _date_time
+    elif typ == "number":
+        convert = _number
+    elif typ == "integer":
+        convert = _exact(int)
+    elif typ == "string":
+        convert = _exact(str)
+    elif typ == "boolean":
+        convert = _exact(bool)
+    elif typ == "object":
+        convert = _object(schema.get("properties", {}))
+    elif typ == "array":
+        convert = _array(_compile(schema["items"]))
+    else:
+        raise UnsupportedSchema()
+
+    def convert_nullable(value):
+        if value is None:
+            if nullable:
+                return None
+            raise FastPathMiss()
+        return convert(value)
+
+    return convert_nullable
+
+
+def _date_time(value):
+    if value == "" or not isinstance(value, str):
+        raise FastPathMiss()
+    if CANONICAL_DATE_TIME.match(value):
+        return value
+    value = string_to_datetime(value)
+    if value is None:
+        raise FastPathMiss()
+    return value
+
+
+def _number(value):
+    if type(value) is float:  # pylint: disable=unidiomatic-typecheck
+        return value
+    if isinstance(value, (str, bool)):
+        raise FastPathMiss()
+    return float(value)
+
+
+def _exact(typ):
+    def convert(value):
+        if type(value) is not typ:  # pylint: disable=unidiomatic-typecheck
+            raise FastPathMiss()
+        return value
+
+    return convert
+
+
+def _object(properties):
+    if not properties:
+        return _exact(dict)
+    converters = {key: _compile(prop) for key, prop in properties.items()}
+
+    def convert(value):
+        if not isinstance(value, dict):
+            raise FastPathMiss()
+        return {k: converters[k](v) for k, v in value.items() if k in converters}
+
+    return convert
+
+
+def _array(convert_item):
+    def convert(value):
+        if not isinstance(value, list):
+            raise FastPathMiss()
+        return [convert_item(item) for item in value]
+
+    return convert
+
+
+class RecordTransformer:
+    """Applies a stream's catalog schema and metadata to its records.
+
+    In "full" mode every record goes through singer's Transformer, as the tap
+    always has. In "sampled" mode the first full_records records of the stream
+    and every sample_every-th one after that still do, while the rest take a
+    fast path compiled from the schema that only projects the record onto the
+    schema and coerces dates and numbers. Every fully validated record is
+    also run through the fast path, and if the two ever disagree the stream
+    switches back to full validation for the rest of the run."""
+
+    def __init__(
+        self,
+        tap_stream_id,
+        schema,
+        mdata,
+        mode="full",
+        full_records=DEFAULT_FULL_RECORDS,
+        sample_every=DEFAULT_SAMPLE_EVERY,
+    ):
+        self.tap_stream_id = tap_stream_id
+        self.schema = schema
+        self.mdata = mdata
+        self.sampled = mode == "sampled"
+        self.full_records = full_records
+        self.sample_every = max(1, sample_every)
+        self.count = 0
+        self.fast = None
+        if self.sampled:
+            try:
+                self.fast = _compile(schema)
+            except UnsupportedSchema:
+                LOGGER.info(
+                    "Schema for %s has no fast path, validating every record",
+                    tap_stream_id,
+                )
+                self.sampled = False
+        self.dropped = {
+            breadcrumb[1]
+            for breadcrumb, values in mdata.items()
+            if len(breadcrumb) == 2
+            and values.get("inclusion") != "automatic"
+            and (
+                values.get("selected") is False
+                or values.get("inclusion") == "unsupported"
+            )
+        }
+
+    @classmethod
+    def from_config(cls, tap_stream_id, schema, mdata, config):
+        return cls(
+            tap_stream_id,
+            schema,
+            mdata,
+            mode=config.get("validation_mode", "full"),
+            full_records=int(
+                config.get("validation_full_records", DEFAULT_FULL_RECORDS)
+            ),
+            sample_every=int(
+                config.get("validation_sample_every", DEFAULT_SAMPLE_EVERY)
+            ),
+        )
+
+    @classmethod
+    def for_catalog_entry(cls, entry, config):
+        return cls.from_config(
+            entry.tap_stream_id,
+            entry.schema.to_dict(),
+            metadata.to_map(entry.metadata),
+            config,
+        )
+
+    def full(self, rec):
+        with Transformer() as transformer:
+            return transformer.transform(rec, self.schema, self.mdata)
+
+    def fast_path(self, rec):
+        for key in self.dropped:
+            rec.pop(key, None)
+        return self.fast(rec)
+
+    def transform(self, rec):
+        if not self.sampled:
+            return self.full(rec)
+
+        self.count += 1
+        if self.count > self.full_records and self.count % self.sample_every:
+            try:
+                return self.fast_path(rec)
+            except FastPathMiss:
+                return self.full(rec)
+
+        # Validated records also check that the fast path agrees with them
+        transformed = self.full(rec)
+        try:
+            matches = self.fast_path(rec) == transformed
+        except FastPathMiss:
+            matches = True
+        if not matches:
+            LOGGER.warning(
+                "Fast path output for a %s record differs from full validation, "
+                "validating every record from now on",
+                self.tap_stream_id,
+            )
+            self.sampled = False
+        return transformed
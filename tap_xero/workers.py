@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+from .decoding import Decoder
+from .validation import RecordTransformer
+from . import streams
+
+# Set up in each worker process by _init_worker
+_transformers = {}
+_decoder = Decoder("legacy")
+_reference = None
+
+
+class DecodedPage:
+    def __init__(self, records, sub_records, max_bookmark):
+        self.records = records
+        self.sub_records = sub_records
+        self.max_bookmark = max_bookmark
+
+
+def _init_worker(
+    catalog, config, decoder_backend="legacy", decoder_plans=None, reference=None
+):
+    global _decoder, _reference  # pylint: disable=global-statement
+    for entry in catalog.streams:
+        if entry.is_selected():
+            _transformers[entry.tap_stream_id] = RecordTransformer.for_catalog_entry(
+                entry, config
+            )
+    _decoder = Decoder(decoder_backend)
+    _decoder.register(decoder_plans or {})
+    _reference = reference
+
+
+def _transform(tap_stream_id, records):
+    transformer = _transformers[tap_stream_id]
+    return [transformer.transform(rec) for rec in records]
+
+
+def decode_page(tap_stream_id, sub_stream_id, text):
+    """Runs in a worker process: decodes a raw response, formats it and
+    transforms the records (and their substream rows) against the catalog."""
+    stream = streams.streams_by_id[tap_stream_id]
+    records = _decoder.decode(tap_stream_id, text)
+    if not records:
+        return DecodedPage([], [], None)
+    formatted = stream.format_fn(records)
+    records = records if formatted is None else formatted
+    max_bookmark = (
+        max(record[stream.bookmark_key] for record in records)
+        if stream.bookmark_key
+        else None
+    )
+    transformed = _transform(tap_stream_id, records)
+    sub_records = []
+    if sub_stream_id:
+        rows = [row for parent in records for row in stream.sub_rows(parent)]
+        if _reference:
+            rows = _reference.enrich_rows(sub_stream_id, rows)
+        sub_records = _transform(sub_stream_id, rows)
+    return DecodedPage(transformed, sub_records, max_bookmark)
+
+
+class DecodePool:
+    """Process pool that takes the CPU-bound JSON decoding, date parsing and
+    schema transformation of fetched pages off the main process."""
+
+    def __init__(self, catalog, workers, decoder, config, reference=None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(catalog, config, decoder.backend, decoder.plans, reference),
+        )
+
+    def submit(self, tap_stream_id, sub, text):
+        sub_stream_id = sub.tap_stream_id if sub else None
+        return self.executor.submit(decode_page, tap_stream_id, sub_stream_id, text)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,100 @@
+"""Fixtures shared by the unit tests."""
+import json
+from singer import metadata
+from singer.catalog import Catalog, CatalogEntry, Schema
+from tap_xero import load_correct_schema, load_metadata
+from tap_xero.context import Context
+from tap_xero.streams import streams_by_id
+
+CONFIG = {"start_date": "2020-01-01T00:00:00Z", "tenant_id": "t"}
+
+
+def build_catalog(stream_ids, config=None):
+    entries = []
+    for stream_id in stream_ids:
+        schema = load_correct_schema(stream_id, config)
+        mdata = load_metadata(streams_by_id[stream_id], schema)
+        mdata = metadata.write(metadata.to_map(mdata), (), "selected", True)
+        entries.append(
+            CatalogEntry(
+                tap_stream_id=stream_id,
+                stream=stream_id,
+                schema=Schema.from_dict(schema),
+                metadata=metadata.to_list(mdata),
+            )
+        )
+    return Catalog(entries)
+
+
+def invoices_page(page):
+    """A full page of invoices."""
+    return [
+        {
+            "InvoiceID": f"inv-{page}-{i}",
+            "UpdatedDateUTC": "/Date(1603895333000+0000)/",
+            "LineItems": [],
+        }
+        for i in range(100)
+    ]
+
+
+class ListSink:
+    def __init__(self):
+        self.messages = []
+
+    def write_schema(self, stream_id, schema, key_properties):
+        self.messages.append(("schema", stream_id))
+
+    def write_record(self, stream_id, record):
+        self.messages.append(("record", record))
+
+    def write_state(self, state):
+        self.messages.append(("state", json.loads(json.dumps(state))))
+
+    def finish_stream(self, stream_id):
+        pass
+
+    def close(self):
+        pass
+
+    def records(self):
+        return [record for kind, record in self.messages if kind == "record"]
+
+
+def serve(ctx, pages):
+    """Answers ctx's requests from pages instead of Xero, recording each one
+    as (stream, params with the since) in ctx.requests. pages is either a
+    list of each page's records, with empty pages past its end, or a function
+    of (stream, since, params) returning a response's records."""
+    ctx.requests = []
+
+    def fetch_raw(tap_stream_id, since=None, **params):
+        ctx.requests.append((tap_stream_id, {"since": since, **params}))
+        if callable(pages):
+            records = pages(tap_stream_id, since, params)
+        else:
+            page = params.get("page", 1)
+            records = pages[page - 1] if page <= len(pages) else []
+        resource = tap_stream_id.title().replace("_", "")
+        return json.dumps({resource: records})
+
+    ctx.client.fetch_raw = fetch_raw
+
+
+def make_ctx(config, streams, pages=None, state=None, sink=None):
+    """A context syncing streams with config over CONFIG, writing to a
+    ListSink (or sink), with its token taken as exchanged and its requests
+    served from pages, if given (see serve)."""
+    config = {**CONFIG, **config}
+    ctx = Context(
+        config,
+        state or {},
+        build_catalog(streams, config),
+        sink=sink or ListSink(),
+    )
+    ctx.client.refresh_credentials = lambda config, force=False: None
+    ctx.client.tenant_id = ctx.config["tenant_id"]
+    ctx.client.access_token = "token"
+    if pages is not None:
+        serve(ctx, pages)
+    return ctx
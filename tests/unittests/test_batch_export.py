@@ -0,0 +1,108 @@
+import os
+import gzip
+import json
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+from tap_xero import sinks
+from tap_xero.sinks import BatchExportSink
+
+SCHEMA = {
+    "type": ["null", "object"],
+    "properties": {
+        "InvoiceID": {"type": ["string"]},
+        "Total": {"type": ["null", "number"]},
+    },
+}
+
+
+class TestBatchExportSink(unittest.TestCase):
+    def test_parts_manifest_and_state(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sink = BatchExportSink(tmp, max_part_bytes=100)
+            sink.write_schema("invoices", SCHEMA, ["InvoiceID"])
+            for i in range(5):
+                sink.write_record("invoices", {"InvoiceID": str(i), "Total": 1.5})
+            sink.write_state({"bookmarks": {"invoices": {"UpdatedDateUTC": "x"}}})
+            sink.close()
+
+            self.assertEqual(os.listdir(tmp), [os.path.basename(sink.directory)])
+            with open(os.path.join(sink.directory, "manifest.json")) as f:
+                manifest = json.load(f)
+            stream = manifest["streams"]["invoices"]
+            self.assertEqual(stream["records"], 5)
+            self.assertGreater(len(stream["parts"]), 1)
+            self.assertEqual(
+                manifest["state"]["bookmarks"]["invoices"]["UpdatedDateUTC"], "x"
+            )
+
+            rows = []
+            for part in stream["parts"]:
+                with gzip.open(part["path"], "rt") as f:
+                    rows.extend(json.loads(line) for line in f)
+            self.assertEqual([r["InvoiceID"] for r in rows], ["0", "1", "2", "3", "4"])
+
+            with open(
+                os.path.join(sink.directory, "invoices", "copy_manifest.json")
+            ) as f:
+                entries = json.load(f)["entries"]
+            self.assertEqual(len(entries), len(stream["parts"]))
+
+    def test_runs_write_to_their_own_directories(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(2):
+                sink = BatchExportSink(tmp)
+                sink.write_schema("invoices", SCHEMA, ["InvoiceID"])
+                sink.write_record("invoices", {"InvoiceID": str(i), "Total": 1.5})
+                sink.close()
+            runs = sorted(os.listdir(tmp))
+            self.assertEqual(len(runs), 2)
+            for i, run in enumerate(runs):
+                path = os.path.join(tmp, run, "invoices", "part-00000.jsonl.gz")
+                with gzip.open(path, "rt") as f:
+                    self.assertEqual(json.loads(f.read())["InvoiceID"], str(i))
+
+    def test_finishes_part_when_stream_ends(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sink = BatchExportSink(tmp)
+            sink.write_schema("invoices", SCHEMA, ["InvoiceID"])
+            sink.write_record("invoices", {"InvoiceID": "0", "Total": 1.5})
+            sink.finish_stream("invoices")
+            path = os.path.join(sink.directory, "invoices", "part-00000.jsonl.gz")
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(json.loads(f.read())["InvoiceID"], "0")
+            sink.close()
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow isn't installed")
+    def test_parquet_parts(self):
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryDirectory() as tmp:
+            sink = BatchExportSink(tmp, export_format="parquet")
+            sink.write_schema("invoices", SCHEMA, ["InvoiceID"])
+            for i in range(3):
+                sink.write_record("invoices", {"InvoiceID": str(i), "Total": 1.5})
+            sink.close()
+            with open(os.path.join(sink.directory, "manifest.json")) as f:
+                parts = json.load(f)["streams"]["invoices"]["parts"]
+            table = pq.read_table(parts[0]["path"])
+            self.assertEqual(table.column("InvoiceID").to_pylist(), ["0", "1", "2"])
+            self.assertEqual(table.column("Total").to_pylist(), [1.5] * 3)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow isn't installed")
+    def test_parquet_writes_row_groups_as_they_fill(self):
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            sinks, "PARQUET_ROW_GROUP_BYTES", 100
+        ):
+            sink = BatchExportSink(tmp, export_format="parquet")
+            sink.write_schema("invoices", SCHEMA, ["InvoiceID"])
+            for i in range(10):
+                sink.write_record("invoices", {"InvoiceID": str(i), "Total": 1.5})
+            sink.close()
+            path = os.path.join(sink.directory, "invoices", "part-00000.parquet")
+            self.assertGreater(pq.ParquetFile(path).num_row_groups, 1)
+            ids = pq.read_table(path).column("InvoiceID").to_pylist()
+            self.assertEqual(ids, [str(i) for i in range(10)])
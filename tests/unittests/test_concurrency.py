@@ -0,0 +1,84 @@
+import json
+import time
+import threading
+import unittest
+import requests
+from tap_xero.concurrency import ConcurrencyController
+from tap_xero.streams import streams_by_id
+from helpers import make_ctx
+
+
+def response(status, body=""):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body.encode()
+    resp.headers["Retry-After"] = "0"
+    return resp
+
+
+class FakeSession:
+    """Serves 5 full pages of invoices and then an empty one, after a short
+    wait, throttling the first request for page 3."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.throttled = False
+
+    def send(self, request):
+        page = int(request.url.split("page=")[1].split("&")[0])
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            throttle = page == 3 and not self.throttled
+            self.throttled = self.throttled or throttle
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        if throttle:
+            return response(429)
+        invoices = [
+            {"InvoiceID": f"inv-{page}-{i}", "UpdatedDateUTC": "2020-02-01T00:00:00Z"}
+            for i in range(100 if page <= 5 else 0)
+        ]
+        return response(200, json.dumps({"Invoices": invoices}))
+
+
+class TestConcurrencyController(unittest.TestCase):
+    def test_additive_increase_multiplicative_decrease(self):
+        controller = ConcurrencyController(max_limit=5)
+        for _ in range(20):
+            controller.acquire()
+            controller.release(0.1)
+        self.assertEqual(controller.allowed(), 5)
+
+        controller.acquire()
+        controller.release(0.1, throttled=True)
+        self.assertEqual(controller.allowed(), 2)
+        # a second throttled response from the same round doesn't count again
+        controller.acquire()
+        controller.release(0.1, throttled=True)
+        self.assertEqual(controller.allowed(), 2)
+
+        controller.decreased_at -= 1
+        controller.acquire()
+        controller.release(0.5)
+        self.assertEqual(controller.allowed(), 1)
+        self.assertEqual(controller.decreases, 2)
+
+    def test_pooled_sync_keeps_within_limit(self):
+        ctx = make_ctx({"decode_workers": 2}, ["invoices"])
+        session = FakeSession()
+        ctx.client.session = session
+        try:
+            streams_by_id["invoices"].sync(ctx)
+        finally:
+            ctx.close()
+
+        ids = [record["InvoiceID"] for record in ctx.sink.records()]
+        expected = [f"inv-{p}-{i}" for p in range(1, 6) for i in range(100)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(ctx.client.concurrency.decreases, 1)
+        self.assertLessEqual(session.max_in_flight, ctx.client.concurrency.max_limit)
+        self.assertGreater(session.max_in_flight, 1)
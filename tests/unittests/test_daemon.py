@@ -0,0 +1,62 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+from tap_xero import client
+from tap_xero.daemon import Daemon
+from helpers import CONFIG, build_catalog, serve
+
+UPDATED = "2020-03-01T00:00:00.000000Z"
+
+
+def invoices_since(tap_stream_id, since, params):
+    if since == CONFIG["start_date"]:
+        return [{"InvoiceID": "inv-1", "UpdatedDateUTC": UPDATED}]
+    return []
+
+
+class TestDaemon(unittest.TestCase):
+    def test_cycles_reuse_token_and_carry_state(self):
+        get_token = mock.Mock(return_value=("token", 1800))
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            client, "get_token", get_token
+        ):
+            state_path = os.path.join(tmp, "state.json")
+            out_dir = os.path.join(tmp, "out")
+            os.makedirs(out_dir)
+            daemon = Daemon(
+                {**CONFIG, "daemon_interval": 0.01},
+                build_catalog(["invoices"]),
+                {},
+                state_path=state_path,
+                output_dir=out_dir,
+            )
+            serve(daemon.ctx, invoices_since)
+            daemon.run(max_cycles=2)
+
+            self.assertEqual(get_token.call_count, 1)
+            since = [params["since"] for _, params in daemon.ctx.requests]
+            self.assertEqual(since, [CONFIG["start_date"], UPDATED])
+            outputs = sorted(os.listdir(out_dir))
+            self.assertEqual(len(outputs), 2)
+            with open(os.path.join(out_dir, outputs[0])) as f:
+                types = [json.loads(line)["type"] for line in f]
+            self.assertIn("RECORD", types)
+            self.assertEqual(types[-1], "STATE")
+            with open(state_path) as f:
+                bookmark = json.load(f)["bookmarks"]["invoices"]["UpdatedDateUTC"]
+            self.assertEqual(bookmark, UPDATED)
+
+    def test_token_reused_until_near_expiry(self):
+        get_token = mock.Mock(return_value=("token", 1800))
+        xero = client.XeroClient({})
+        with mock.patch.object(client, "get_token", get_token):
+            xero.refresh_credentials(CONFIG)
+            xero.refresh_credentials(CONFIG)
+            self.assertEqual(get_token.call_count, 1)
+            xero.refresh_credentials(CONFIG, force=True)
+            self.assertEqual(get_token.call_count, 2)
+            xero.token_expires_at = 0
+            xero.refresh_credentials(CONFIG)
+            self.assertEqual(get_token.call_count, 3)
@@ -0,0 +1,49 @@
+import json
+import unittest
+from tap_xero import workers
+from helpers import build_catalog
+
+PAGE = json.dumps(
+    {
+        "Invoices": [
+            {
+                "InvoiceID": "inv-1",
+                "Total": 10.10,
+                "UpdatedDateUTC": "/Date(1603895333000+0000)/",
+                "LineItems": [
+                    {
+                        "LineItemID": "li-1",
+                        "Description": "two\nlines",
+                        "LineAmount": 10.10,
+                        "Tracking": [],
+                    }
+                ],
+            }
+        ]
+    }
+)
+
+
+class TestDecodePage(unittest.TestCase):
+    def setUp(self):
+        workers._init_worker(build_catalog(["invoices", "invoices_lines"]), {})
+
+    def test_decodes_and_transforms_page(self):
+        page = workers.decode_page("invoices", "invoices_lines", PAGE)
+        self.assertEqual(page.max_bookmark, "2020-10-28T14:28:53.000000Z")
+        self.assertEqual(page.records[0]["InvoiceID"], "inv-1")
+        self.assertEqual(page.records[0]["Total"], 10.1)
+        self.assertEqual(
+            page.sub_records[0],
+            {
+                "LineItemID": "li-1",
+                "ParentID": "inv-1",
+                "Description": '"two\\nlines"',
+                "LineAmount": 10.1,
+                "Tracking": None,
+            },
+        )
+
+    def test_empty_page(self):
+        page = workers.decode_page("invoices", None, '{"Invoices": []}')
+        self.assertEqual(page.records, [])
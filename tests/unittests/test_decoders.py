@@ -0,0 +1,126 @@
+import json
+import unittest
+import singer
+from singer import metadata, Transformer
+from tap_xero.decoding import Decoder, catalog_plans, _load_backend
+from tap_xero.streams import streams_by_id
+from helpers import build_catalog
+
+SAMPLES = {
+    "invoices": """{"Id": "1", "Status": "OK", "DateTimeUTC": "/Date(1603895333000)/",
+        "Invoices": [{"Type": "ACCREC", "InvoiceID": "inv-1", "InvoiceNumber": "INV-1",
+        "Date": "/Date(1603843200000+0000)/", "DueDate": "2020-11-20T00:00:00",
+        "UpdatedDateUTC": "/Date(1603895333000+1300)/", "Status": "PAID",
+        "SubTotal": 100.10, "TotalTax": 15.015, "Total": 115.115, "AmountDue": 0.00,
+        "CurrencyRate": 1.000000, "Reference": "2020-10-28 meeting",
+        "Contact": {"ContactID": "c-1", "Name": "Bob", "UpdatedDateUTC": "/Date(1603895333000)/"},
+        "Payments": [{"PaymentID": "p-1", "Date": "/Date(-1565568000000+0000)/", "Amount": 115.12}],
+        "LineItems": [{"LineItemID": "li-1", "Description": "Widgets\\nand more",
+          "Quantity": 2.5000, "UnitAmount": 40.04, "LineAmount": 100.10, "TaxAmount": 15.02,
+          "AccountCode": "200", "TaxType": "OUTPUT",
+          "Tracking": [{"TrackingCategoryID": "tc-1", "Name": "Region", "Option": "North"}]},
+          {"LineItemID": "li-2", "Description": null, "Quantity": 1, "UnitAmount": 0,
+          "LineAmount": 0, "Tracking": []}]},
+        {"Type": "ACCPAY", "InvoiceID": "inv-2", "Date": "/Date(0+0000)/",
+        "UpdatedDateUTC": "2020-10-28T14:28:53.123", "Total": -12.5, "LineItems": []}]}""",
+    "journals": """{"Journals": [{"JournalID": "j-1", "JournalNumber": 42,
+        "JournalDate": "/Date(1603843200000+0000)/", "CreatedDateUTC": "/Date(1603895333000+0000)/",
+        "Reference": "", "JournalLines": [{"JournalLineID": "jl-1", "AccountID": "a-1",
+        "AccountCode": "200", "NetAmount": -100.10, "GrossAmount": -115.115, "TaxAmount": -15.015,
+        "Description": "x", "TrackingCategories": []}]}]}""",
+    "repeating_invoices": """{"RepeatingInvoices": [{"RepeatingInvoiceID": "ri-1",
+        "Type": "ACCREC", "Reference": "/Date(1586908800000+0000)/", "Status": "AUTHORISED",
+        "Schedule": {"Period": 1, "Unit": "MONTHLY", "DueDate": 20,
+          "StartDate": "/Date(1583020800000+0000)/", "EndDate": "/Date(1586908800000+0000)/",
+          "NextScheduledDate": "2020-04-01T00:00:00"},
+        "Total": 115.115, "LineItems": [{"LineItemID": "ri-li-1", "Description": "Rent",
+          "LineAmount": 100.10, "Tracking": [{"TrackingCategoryID": "tc-1",
+          "Name": "Region", "Option": "2020-10-28T00:00:00"}]}]}]}""",
+    "tracking_categories": """{"TrackingCategories": [{"TrackingCategoryID": "tc-1",
+        "Name": "Region", "Status": "ACTIVE", "Options": [{"TrackingOptionID": "to-1",
+        "Name": "/Date(1586908800000+0000)/", "Status": "ACTIVE"}]}]}""",
+    "contacts": """{"Contacts": [{"ContactID": "c-1", "Name": "Bob", "ContactStatus": "ACTIVE",
+        "UpdatedDateUTC": "/Date(1603895333000+0000)/", "IsSupplier": false,
+        "Balances": {"AccountsReceivable": {"Outstanding": 10.50, "Overdue": 0.00}},
+        "ContactGroups": [], "Addresses": [{"AddressType": "POBOX", "City": "Wellington"}]}]}""",
+}
+
+
+def emitted(decoder, catalog, stream_id, text):
+    """The Singer messages the tap would write for a response."""
+    stream = streams_by_id[stream_id]
+    sub_id = stream_id + "_lines"
+    records = decoder.decode(stream_id, text)
+    formatted = stream.format_fn(records)
+    records = records if formatted is None else formatted
+    out = []
+    for parent in records:
+        rows = [(stream_id, parent)]
+        if catalog.get_stream(sub_id):
+            rows += [(sub_id, row) for row in stream.sub_rows(parent)]
+        for tap_stream_id, rec in rows:
+            entry = catalog.get_stream(tap_stream_id)
+            with Transformer() as transformer:
+                rec = transformer.transform(
+                    rec, entry.schema.to_dict(), metadata.to_map(entry.metadata)
+                )
+            message = singer.RecordMessage(stream=tap_stream_id, record=rec)
+            out.append(singer.format_message(message))
+    return out
+
+
+def available_backends():
+    backends = []
+    for name in ("json", "orjson", "simdjson"):
+        try:
+            _load_backend(name)
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+class TestDecoderBackends(unittest.TestCase):
+    def setUp(self):
+        self.catalog = build_catalog(
+            [
+                "invoices",
+                "invoices_lines",
+                "journals",
+                "journals_lines",
+                "contacts",
+                "repeating_invoices",
+                "repeating_invoices_lines",
+                "tracking_categories",
+            ]
+        )
+        self.legacy = Decoder("legacy")
+
+    def test_backends_match_legacy_output(self):
+        for backend in available_backends():
+            decoder = Decoder(backend)
+            decoder.register(catalog_plans(self.catalog))
+            for stream_id, text in SAMPLES.items():
+                with self.subTest(backend=backend, stream=stream_id):
+                    expected = emitted(self.legacy, self.catalog, stream_id, text)
+                    self.assertTrue(expected)
+                    self.assertEqual(
+                        emitted(decoder, self.catalog, stream_id, text), expected
+                    )
+
+    def test_unregistered_stream_uses_legacy_decode(self):
+        decoder = Decoder("json")
+        text = SAMPLES["contacts"]
+        self.assertEqual(
+            decoder.decode("contacts", text), self.legacy.decode("contacts", text)
+        )
+
+    def test_number_paths_are_exact(self):
+        for backend in available_backends():
+            decoder = Decoder(backend)
+            decoder.register(catalog_plans(self.catalog))
+            invoice = decoder.decode("invoices", SAMPLES["invoices"])[0]
+            expected = self.legacy.decode("invoices", SAMPLES["invoices"])[0]
+            with self.subTest(backend=backend):
+                self.assertEqual(invoice["Total"], expected["Total"])
+                self.assertEqual(invoice["UpdatedDateUTC"], expected["UpdatedDateUTC"])
@@ -0,0 +1,69 @@
+import unittest
+from tap_xero.dedup import StreamDedup, record_key
+from tap_xero.streams import streams_by_id
+from helpers import make_ctx
+from test_record_resume import FailingSink
+
+
+def invoice(invoice_id, updated):
+    return {
+        "InvoiceID": invoice_id,
+        "UpdatedDateUTC": updated,
+        "LineItems": [{"LineItemID": invoice_id + "-li", "Tracking": []}],
+    }
+
+
+def sync(pages, state=None, sink=None):
+    ctx = make_ctx({"dedup": True}, ["invoices", "invoices_lines"], pages, state, sink)
+    try:
+        streams_by_id["invoices"].sync(ctx, streams_by_id["invoices_lines"])
+    finally:
+        ctx.close()
+    return ctx
+
+
+class TestDedup(unittest.TestCase):
+    def test_drops_repeats_with_their_lines_within_and_across_runs(self):
+        first = [invoice(f"inv-{i}", "2020-02-01T00:00:00Z") for i in range(99)]
+        first.append(invoice("inv-x", "2020-03-01T00:00:00Z"))
+        # inv-x comes round again on the next page, unchanged, as does inv-0
+        # after being updated
+        second = [
+            invoice("inv-x", "2020-03-01T00:00:00Z"),
+            invoice("inv-0", "2020-03-01T00:00:00Z"),
+        ]
+        ctx = sync([first, second])
+        written = ctx.sink.records()
+        self.assertEqual(len(written), 101 * 2)
+        parents = [r.get("ParentID", r.get("InvoiceID")) for r in written]
+        self.assertEqual(parents.count("inv-x"), 2)
+        self.assertEqual(parents.count("inv-0"), 4)
+        self.assertEqual(len(ctx.state["dedup"]["invoices"]["keys"]), 2)
+
+        # the next run's inclusive bookmark returns the same two records again
+        ctx = sync([second], ctx.state)
+        self.assertEqual(ctx.sink.records(), [])
+
+    def test_forgets_least_recently_seen_keys_past_cap(self):
+        dedup = StreamDedup(max_keys=2)
+        for key in ("a", "b", "c"):
+            self.assertTrue(dedup.is_new(key, 1))
+            dedup.add(key, 1)
+        self.assertFalse(dedup.is_new("c", 1))
+        self.assertTrue(dedup.is_new("a", 1))
+        self.assertEqual(dedup.dropped, 1)
+
+    def test_resumes_with_the_record_that_failed_to_write(self):
+        invoices = [invoice(f"inv-{i}", "2020-02-01T00:00:00Z") for i in range(210)]
+        pages = [invoices[:100], invoices[100:200], invoices[200:]]
+        sink = FailingSink("inv-150")
+        with self.assertRaises(IOError):
+            sync(pages, sink=sink)
+        state = sink.messages[-1][1]
+        failed = record_key(streams_by_id["invoices"], invoices[150])
+        self.assertNotIn(failed, state["dedup"]["invoices"]["keys"])
+
+        resumed = sync(pages, state)
+        written = sink.records() + resumed.sink.records()
+        ids = [r["InvoiceID"] for r in written if "LineItemID" not in r]
+        self.assertEqual(ids, [f"inv-{i}" for i in range(210)])
@@ -0,0 +1,175 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+import multiprocessing
+from datetime import datetime, timezone
+from unittest import mock
+from tap_xero import client, distributed
+from tap_xero.streams import streams_by_id
+from helpers import build_catalog, make_ctx
+
+CONFIG = {"tenant_id": "t1", "start_date": "2020-01-01T00:00:00Z"}
+
+
+def journals_to(latest):
+    """Pages of journals numbered 1 to latest, served by the offset."""
+
+    def pages(tap_stream_id, since, params):
+        offset = params["offset"]
+        return [
+            {"JournalID": f"j-{n}", "JournalNumber": n}
+            for n in range(offset + 1, min(offset + 100, latest) + 1)
+        ]
+
+    return pages
+
+
+class FakeWorker(distributed.Worker):
+    """Runs a unit by writing a record naming it instead of calling Xero."""
+
+    def run_unit(self, unit, out):
+        out.write(json.dumps({"unit": unit["id"], "owner": self.owner}) + "\n")
+        return {"max_updated": unit.get("end") or "2020-12-01T00:00:00.000000Z"}
+
+
+def run_worker(work_dir, name):
+    return FakeWorker(CONFIG, None, work_dir, owner=name, lease_seconds=30).run()
+
+
+class TestDistributed(unittest.TestCase):
+    def test_plans_windows_from_bookmarks(self):
+        catalog = build_catalog(["invoices", "accounts", "currencies"])
+        states = {"t1": {"bookmarks": {"accounts": {"UpdatedDateUTC": "x"}}}}
+        config = {**CONFIG, "tenant_ids": ["t1", "t2"]}
+        now = datetime(2020, 6, 1, tzinfo=timezone.utc)
+        units = distributed.plan_units(config, catalog, states, 100, now)
+
+        t1 = [u for u in units if u["tenant_id"] == "t1"]
+        windows = [(u["start"][:10], u["end"]) for u in t1 if u["stream"] == "invoices"]
+        self.assertEqual(
+            windows,
+            [("2020-01-01", "2020-04-10T00:00:00.000000Z"), ("2020-04-10", None)],
+        )
+        accounts = [u for u in t1 if u["stream"] == "accounts"][0]
+        self.assertEqual(accounts["state"], {"bookmarks": states["t1"]["bookmarks"]})
+        self.assertEqual(len(units), 2 * len(t1))
+
+    def test_plans_journal_ranges(self):
+        catalog = build_catalog(["journals"])
+        states = {"t1": {"bookmarks": {"journals": {"JournalNumber": 5000}}}}
+        units = distributed.plan_units(
+            CONFIG, catalog, states, latest_journals={"t1": 27000}, journal_range=10000
+        )
+        ranges = [(u["start"], u["end"]) for u in units]
+        self.assertEqual(ranges, [(5000, 15000), (15000, 25000), (25000, None)])
+
+        units = distributed.plan_units(CONFIG, catalog, {})
+        self.assertEqual([u.get("window") for u in units], [None])
+
+    def test_finds_latest_journal_number(self):
+        for latest in [0, 1, 99, 100, 101, 12345]:
+            ctx = make_ctx({}, [], journals_to(latest))
+            self.assertEqual(distributed.latest_journal_number(ctx), latest)
+
+    def test_syncs_journal_range(self):
+        ctx = make_ctx({}, ["journals"], journals_to(1000))
+        last = streams_by_id["journals"].sync_window(ctx, None, 150, 420)
+        numbers = [record["JournalNumber"] for record in ctx.sink.records()]
+        self.assertEqual(numbers, list(range(151, 421)))
+        self.assertEqual(last, 420)
+        ctx.close()
+
+    def test_workers_run_every_unit_once(self):
+        units = [
+            distributed._unit("t1", "invoices", i, f"2020-0{i + 1}-01", None)
+            for i in range(8)
+        ]
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = distributed.LeaseStore(os.path.join(work_dir, "leases.sqlite"))
+            store.add(units)
+            with multiprocessing.get_context("fork").Pool(3) as pool:
+                done = pool.starmap(run_worker, [(work_dir, f"w{i}") for i in range(3)])
+            self.assertEqual(sum(done), 8)
+            rows = store.units()
+            self.assertEqual([r[1] for r in rows], ["done"] * 8)
+            for unit, _, _ in rows:
+                with open(distributed.unit_output_path(work_dir, unit)) as f:
+                    self.assertEqual(json.loads(f.read())["unit"], unit["id"])
+            store.close()
+
+    def test_unit_output_has_no_states(self):
+        def fetch_raw(self, tap_stream_id, since=None, **params):
+            return json.dumps({"Currencies": [{"Code": "NZD"}]})
+
+        worker = distributed.Worker(CONFIG, build_catalog(["currencies"]), "work")
+        worker.access_token = "token"
+        with tempfile.TemporaryFile("w+") as out, mock.patch.object(
+            client.XeroClient, "fetch_raw", fetch_raw
+        ):
+            result = worker.run_unit(distributed._unit("t1", "currencies", 0), out)
+            out.seek(0)
+            types = [json.loads(line)["type"] for line in out]
+        self.assertEqual(types, ["SCHEMA", "RECORD"])
+        self.assertIn("bookmark", result)
+
+    def test_unit_records_carry_tenant(self):
+        sink = distributed.UnitSink(tenant_id="t2")
+        sink.out = io.StringIO()
+        sink.write_schema("currencies", {"properties": {"Code": {}}}, ["Code"])
+        sink.write_record("currencies", {"Code": "NZD"})
+        schema, record = [json.loads(line) for line in sink.out.getvalue().splitlines()]
+        self.assertEqual(schema["key_properties"], ["TenantID", "Code"])
+        self.assertIn("TenantID", schema["schema"]["properties"])
+        self.assertEqual(record["record"], {"Code": "NZD", "TenantID": "t2"})
+
+    def test_rejects_export_dir(self):
+        with self.assertRaises(Exception):
+            distributed.Worker({**CONFIG, "export_dir": "out"}, None, "work")
+
+    def test_expired_lease_can_be_claimed_again(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = distributed.LeaseStore(os.path.join(work_dir, "leases.sqlite"))
+            store.add([distributed._unit("t1", "currencies", 0)])
+            unit = store.claim("a", lease_seconds=-1)
+            self.assertEqual(store.claim("b", lease_seconds=60), unit)
+            self.assertFalse(store.complete(unit["id"], "a", {}))
+            self.assertTrue(store.complete(unit["id"], "b", {}))
+            self.assertIsNone(store.claim("c", lease_seconds=60))
+            store.close()
+
+    def test_refuses_to_plan_twice(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = distributed.LeaseStore(os.path.join(work_dir, "leases.sqlite"))
+            store.add([distributed._unit("t1", "invoices", 0, "2020-01-01", None)])
+            replanned = distributed._unit("t1", "invoices", 0, "2021-01-01", None)
+            with self.assertRaises(Exception):
+                store.add([replanned])
+            self.assertEqual(
+                [unit["start"] for unit, _, _ in store.units()], ["2020-01-01"]
+            )
+            store.close()
+
+    def test_merge_stops_at_first_unfinished_window(self):
+        def window(i, start, end):
+            return distributed._unit("t1", "invoices", i, start, end)
+
+        units = [
+            (window(0, "2020-01-01", "2020-04-01"), "done", {"max_updated": "a"}),
+            (window(1, "2020-04-01", "2020-07-01"), "leased", None),
+            (window(2, "2020-07-01", None), "done", {"max_updated": "b"}),
+            (
+                distributed._unit("t1", "contacts", 0),
+                "done",
+                {"bookmark": {"UpdatedDateUTC": "c"}},
+            ),
+        ]
+        merged = distributed.merge_states({"t1": {}}, units)
+        bookmarks = merged["t1"]["bookmarks"]
+        self.assertEqual(bookmarks["invoices"]["UpdatedDateUTC"], "2020-04-01")
+        self.assertEqual(bookmarks["contacts"], {"UpdatedDateUTC": "c"})
+
+        units[1] = (units[1][0], "done", {"max_updated": None})
+        merged = distributed.merge_states({"t1": {}}, units)
+        self.assertEqual(merged["t1"]["bookmarks"]["invoices"]["UpdatedDateUTC"], "b")
@@ -0,0 +1,63 @@
+import os
+import time
+import tempfile
+import unittest
+import tap_xero
+from helpers import CONFIG, invoices_page, make_ctx
+
+
+class TestMaxRuntime(unittest.TestCase):
+    def test_stops_at_deadline_and_resumes_from_checkpoint(self):
+        def pages(tap_stream_id, since, params):
+            if params["page"] == 2:
+                # the deadline passes while the second page is being fetched
+                ctx.deadline = time.monotonic()
+            return invoices_page(params["page"])
+
+        ctx = make_ctx({"max_runtime": 600}, ["invoices", "journals"], pages)
+        tap_xero.sync(ctx)
+
+        requested = [(stream, params["page"]) for stream, params in ctx.requests]
+        self.assertEqual(requested, [("invoices", 1), ("invoices", 2)])
+        self.assertEqual(len(ctx.sink.records()), 200)
+        kind, state = ctx.sink.messages[-1]
+        self.assertEqual(kind, "state")
+        self.assertEqual(
+            state["bookmarks"]["invoices"]["offset"],
+            {"page": 3, "since": CONFIG["start_date"]},
+        )
+
+    def test_targeted_refresh_stops_at_deadline(self):
+        def pages(tap_stream_id, since, params):
+            ctx.deadline = time.monotonic()
+            return [{"InvoiceID": i, "LineItems": []} for i in params["IDs"].split(",")]
+
+        config = {
+            "max_runtime": 600,
+            "refresh_ids": {"invoices": [f"inv-{i}" for i in range(150)]},
+        }
+        ctx = make_ctx(config, ["invoices"], pages)
+        tap_xero.sync_targeted(ctx)
+
+        self.assertEqual(len(ctx.requests), 1)
+        self.assertEqual(len(ctx.sink.records()), 50)
+        self.assertEqual(ctx.sink.messages[-1][0], "state")
+
+    def test_reconcile_stops_at_deadline(self):
+        def pages(tap_stream_id, since, params):
+            ctx.deadline = time.monotonic()
+            return invoices_page(params["page"])
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            config = {
+                "max_runtime": 600,
+                "reconcile_streams": ["invoices"],
+                "reconcile_index_dir": index_dir,
+            }
+            ctx = make_ctx(config, [], pages)
+            tap_xero.sync_reconcile(ctx)
+
+            self.assertEqual(len(ctx.requests), 1)
+            self.assertEqual(ctx.sink.messages[-1][0], "state")
+            # the index is only saved once the whole stream has been read
+            self.assertEqual(os.listdir(index_dir), [])
@@ -0,0 +1,82 @@
+import io
+import json
+import time
+import threading
+import unittest
+import tap_xero
+from tap_xero.sinks import BufferedSingerSink, SpillQueue
+from helpers import invoices_page, make_ctx
+
+
+class BlockingOut(io.StringIO):
+    """Output that blocks until released, like a target busy with a COPY."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, s):
+        self.released.wait()
+        return super().write(s)
+
+
+class SlowOut(io.StringIO):
+    def write(self, s):
+        time.sleep(0.001)
+        return super().write(s)
+
+
+class TestOutputBuffer(unittest.TestCase):
+    def test_spills_past_memory_limit_and_keeps_order(self):
+        queue = SpillQueue(max_bytes=10)
+        lines = [f"line {i}\n" for i in range(6)]
+        for line in lines:
+            queue.put(line)
+        self.assertEqual(queue.spills, 1)
+        self.assertEqual(queue.depth, 6)
+
+        out = queue.get()
+        queue.put("line 6\n")
+        queue.close()
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            out += batch
+        self.assertEqual(out, lines + ["line 6\n"])
+        self.assertEqual(queue.depth, 0)
+
+    def test_sync_carries_on_while_output_is_blocked(self):
+        out = BlockingOut()
+        sink = BufferedSingerSink(max_buffer_bytes=200, out=out)
+        sink.write_schema("invoices", {"type": "object"}, ["InvoiceID"])
+        for i in range(50):
+            sink.write_record("invoices", {"InvoiceID": str(i)})
+        sink.write_state({"bookmarks": {}})
+        self.assertGreater(sink.queue.spilled_bytes, 0)
+
+        out.released.set()
+        sink.close()
+        messages = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(messages), 52)
+        self.assertEqual(messages[-2]["record"], {"InvoiceID": "49"})
+        self.assertEqual(messages[-1]["type"], "STATE")
+
+    def test_failed_sync_still_writes_buffered_output(self):
+        out = SlowOut()
+        sink = BufferedSingerSink(max_buffer_bytes=1000, out=out)
+
+        def pages(tap_stream_id, since, params):
+            if params["page"] == 2:
+                raise RuntimeError("connection reset")
+            return invoices_page(params["page"])
+
+        ctx = make_ctx({}, ["invoices"], pages, sink=sink)
+        with self.assertRaises(RuntimeError):
+            tap_xero.sync(ctx)
+
+        self.assertFalse(sink.writer.is_alive())
+        messages = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(sum(m["type"] == "RECORD" for m in messages), 100)
+        state = messages[-1]["value"]
+        self.assertEqual(state["bookmarks"]["invoices"]["offset"]["page"], 2)
@@ -0,0 +1,65 @@
+import unittest
+from tap_xero.streams import streams_by_id
+from helpers import CONFIG, make_ctx
+
+
+def sync(pages, state=None, **config):
+    pages = [
+        [
+            {"InvoiceID": f"inv-{i}", "UpdatedDateUTC": ts, "LineItems": []}
+            for i, ts in enumerate(timestamps)
+        ]
+        for timestamps in pages
+    ]
+    ctx = make_ctx(config, ["invoices"], pages, state)
+    streams_by_id["invoices"].sync(ctx)
+    return ctx
+
+
+def requests(ctx):
+    return [params for _, params in ctx.requests]
+
+
+def bookmarks(ctx):
+    states = [m[1] for m in ctx.sink.messages if m[0] == "state"]
+    return [state["bookmarks"]["invoices"] for state in states]
+
+
+class TestPaginatedSync(unittest.TestCase):
+    def test_ordered_requests_and_high_water_bookmark(self):
+        full_page = ["2020-03-01T00:00:00Z"] * 99 + ["2020-02-01T00:00:00Z"]
+        ctx = sync([full_page, ["2020-04-01T00:00:00Z"]])
+
+        ordered = {"since": CONFIG["start_date"], "order": "UpdatedDateUTC ASC"}
+        self.assertEqual(
+            requests(ctx), [{**ordered, "page": 1}, {**ordered, "page": 2}]
+        )
+        self.assertEqual(
+            bookmarks(ctx)[1],
+            {
+                "UpdatedDateUTC": "2020-03-01T00:00:00.000000Z",
+                "offset": {"page": 2, "since": CONFIG["start_date"]},
+            },
+        )
+        self.assertEqual(
+            bookmarks(ctx)[-1],
+            {"UpdatedDateUTC": "2020-04-01T00:00:00.000000Z", "offset": {}},
+        )
+
+    def test_resumes_with_saved_since_and_overlaps_fresh_syncs(self):
+        state = {
+            "bookmarks": {
+                "invoices": {
+                    "UpdatedDateUTC": "2020-03-01T00:00:00.000000Z",
+                    "offset": {"page": 2, "since": "2020-02-01T00:00:00.000000Z"},
+                }
+            }
+        }
+        pages = [[], ["2020-04-01T00:00:00Z"]]
+        ctx = sync(pages, state, bookmark_overlap_seconds=300)
+        self.assertEqual(requests(ctx)[0]["since"], "2020-02-01T00:00:00.000000Z")
+        self.assertEqual(requests(ctx)[0]["page"], 2)
+
+        ctx = sync(pages[1:], ctx.state, bookmark_overlap_seconds=300)
+        self.assertEqual(requests(ctx)[0]["since"], "2020-03-31T23:55:00.000000Z")
+        self.assertEqual(requests(ctx)[0]["page"], 1)
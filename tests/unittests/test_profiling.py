@@ -0,0 +1,22 @@
+import os
+import tempfile
+import unittest
+from tap_xero.profiling import StreamProfiler
+
+
+class TestStreamProfiler(unittest.TestCase):
+    def test_writes_profile_and_summary_per_stream(self):
+        self.assertIsNone(StreamProfiler.from_config({}))
+        with tempfile.TemporaryDirectory() as tmp:
+            profiler = StreamProfiler.from_config({"profile_dir": tmp})
+            with profiler.profile("invoices"):
+                rows = [{"n": str(i)} for i in range(1000)]
+            profiler.write_summary()
+
+            self.assertTrue(os.path.exists(os.path.join(tmp, "invoices.prof")))
+            with open(os.path.join(tmp, "summary.txt")) as f:
+                summary = f.read()
+            self.assertIn("==== invoices ====", summary)
+            self.assertIn("lines by memory allocated", summary)
+            self.assertIn("test_profiling.py", summary)
+            self.assertEqual(len(rows), 1000)
@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+from tap_xero import reconcile
+from helpers import make_ctx
+
+
+def reconcile_ctx(
+    index_dir, invoices, page_size=2, existing=None, served_page_size=None
+):
+    config = {
+        "reconcile_streams": ["invoices"],
+        "reconcile_index_dir": index_dir,
+        "reconcile_page_size": page_size,
+    }
+
+    def pages(tap_stream_id, since, params):
+        if "IDs" in params:
+            ids = params["IDs"].split(",")
+            found = [i for i in existing or invoices if i["InvoiceID"] in ids]
+            return found if params["page"] == 1 else []
+        # some endpoints serve pages of their own size whatever pageSize says
+        served = served_page_size or params["pageSize"]
+        start = (params["page"] - 1) * served
+        return invoices[start : start + served]
+
+    return make_ctx(config, [], pages)
+
+
+def requests(ctx):
+    return [params for _, params in ctx.requests]
+
+
+def invoice(invoice_id, status):
+    return {"InvoiceID": invoice_id, "Status": status, "Total": 1.0}
+
+
+class TestReconcile(unittest.TestCase):
+    def test_emits_tombstones_and_status_changes(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            ctx = reconcile_ctx(
+                index_dir,
+                [invoice("a", "DRAFT"), invoice("b", "PAID"), invoice("c", "DRAFT")],
+            )
+            reconcile.reconcile(ctx)
+            self.assertEqual(ctx.sink.messages, [])
+            self.assertEqual(
+                requests(ctx)[0],
+                {
+                    "since": None,
+                    "pageSize": 2,
+                    "order": "InvoiceID ASC",
+                    "summaryOnly": "true",
+                    "page": 1,
+                },
+            )
+            self.assertEqual(len(ctx.requests), 3)
+
+            ctx = reconcile_ctx(
+                index_dir,
+                [invoice("a", "VOIDED"), invoice("d", "PAID")],
+                # c was missed by the scan, but is still there
+                existing=[invoice("c", "DRAFT")],
+            )
+            reconcile.reconcile(ctx)
+            self.assertEqual(
+                requests(ctx)[-1], {"since": None, "IDs": "b,c", "page": 1}
+            )
+            events = {
+                e["RecordID"]: (e["Event"], e["PreviousStatus"], e["Status"])
+                for _, e in ctx.sink.messages
+            }
+            self.assertEqual(
+                events,
+                {
+                    "a": ("status_changed", "DRAFT", "VOIDED"),
+                    "b": ("deleted", "PAID", None),
+                },
+            )
+
+    def test_reads_until_empty_page(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            invoices = [invoice(i, "DRAFT") for i in "abc"]
+            ctx = reconcile_ctx(index_dir, invoices, page_size=5, served_page_size=2)
+            reconcile.reconcile(ctx)
+            index = reconcile.StatusIndex(index_dir, "t", "invoices")
+            self.assertEqual(index.load(), {"a": "DRAFT", "b": "DRAFT", "c": "DRAFT"})
+
+    def test_rejects_streams_without_status(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            ctx = reconcile_ctx(index_dir, [])
+            ctx.config["reconcile_streams"] = ["currencies"]
+            with self.assertRaises(Exception):
+                reconcile.reconcile(ctx)
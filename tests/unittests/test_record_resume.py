@@ -0,0 +1,77 @@
+import unittest
+from tap_xero.streams import PageProgress, streams_by_id
+from helpers import ListSink, make_ctx
+
+
+def invoices(first, count):
+    return [
+        {
+            "InvoiceID": f"inv-{i}",
+            "UpdatedDateUTC": "2020-02-01T00:00:00Z",
+            "LineItems": [{"LineItemID": f"inv-{i}-li", "Tracking": []}],
+        }
+        for i in range(first, first + count)
+    ]
+
+
+class FailingSink(ListSink):
+    """Fails writing the given record, as a broken pipe would."""
+
+    def __init__(self, fail_on):
+        super().__init__()
+        self.fail_on = fail_on
+
+    def write_record(self, stream_id, record):
+        if record.get("InvoiceID") == self.fail_on:
+            raise IOError("Broken pipe")
+        super().write_record(stream_id, record)
+
+
+def sync(pages, sink, state=None, **config):
+    ctx = make_ctx(config, ["invoices", "invoices_lines"], pages, state, sink)
+    try:
+        streams_by_id["invoices"].sync(ctx, streams_by_id["invoices_lines"])
+    finally:
+        ctx.close()
+    return ctx
+
+
+class TestRecordResume(unittest.TestCase):
+    def check_resumes_after_last_record_written(self, **config):
+        pages = [invoices(0, 100), invoices(100, 100), invoices(200, 10)]
+        sink = FailingSink("inv-150")
+        with self.assertRaises(IOError):
+            sync(pages, sink, **config)
+        kind, state = sink.messages[-1]
+        self.assertEqual(kind, "state")
+        offset = state["bookmarks"]["invoices"]["offset"]
+        self.assertEqual((offset["page"], offset["record"]), (2, 50))
+        self.assertEqual(offset["record_id"], "inv-149")
+
+        resumed = ListSink()
+        sync(pages, resumed, state, **config)
+        records = [m for m in sink.messages + resumed.messages if m[0] == "record"]
+        ids = [r.get("LineItemID", r.get("InvoiceID")) for _, r in records]
+        # each invoice followed by its line, once each
+        expected = []
+        for i in range(210):
+            expected += [f"inv-{i}", f"inv-{i}-li"]
+        self.assertEqual(ids, expected)
+
+    def test_resumes_after_last_record_written(self):
+        self.check_resumes_after_last_record_written()
+
+    def test_resumes_after_last_record_written_with_decode_workers(self):
+        self.check_resumes_after_last_record_written(decode_workers=2)
+
+    def test_finds_last_record_written_on_shifted_page(self):
+        stream = streams_by_id["invoices"]
+        page = invoices(0, 100)
+        # inv-3 was updated after the stop and moved to a later page
+        del page[3]
+        progress = PageProgress(written=10, last_id="inv-9")
+        self.assertEqual(progress.start(stream, page), 9)
+        self.assertEqual(progress.written, 9)
+
+        progress = PageProgress(written=10, last_id="inv-gone")
+        self.assertEqual(progress.start(stream, page), 0)
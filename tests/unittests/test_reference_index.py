@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from tap_xero import load_correct_schema
+from tap_xero.reference import ReferenceIndex
+from helpers import make_ctx
+
+RESPONSES = {
+    "accounts": [{"AccountID": "acc-1", "Code": "200", "Name": "Sales"}],
+    "tax_rates": [{"TaxType": "OUTPUT", "Name": "GST on Income", "EffectiveRate": 15}],
+    "items": [{"ItemID": "item-1", "Code": "W", "Name": "Widget"}],
+    "tracking_categories": [
+        {
+            "TrackingCategoryID": "tc-1",
+            "Name": "Region",
+            "Options": [{"TrackingOptionID": "to-1", "Name": "North"}],
+        }
+    ],
+}
+
+
+def reference_ctx(snapshot_dir):
+    config = {"enrich_line_items": True, "reference_snapshot_dir": snapshot_dir}
+    return make_ctx(config, [], lambda stream_id, since, params: RESPONSES[stream_id])
+
+
+def fetched(ctx):
+    return [stream_id for stream_id, _ in ctx.requests]
+
+
+class TestReferenceIndex(unittest.TestCase):
+    def test_enriches_line_items_from_snapshot(self):
+        row = {
+            "LineItemID": "li-1",
+            "AccountCode": "200",
+            "TaxType": "OUTPUT",
+            "ItemCode": "W",
+            "Tracking": {"TrackingCategoryID": "tc-1", "Option": "North"},
+        }
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            ctx = reference_ctx(snapshot_dir)
+            index = ctx.reference_index()
+            self.assertEqual(len(fetched(ctx)), 4)
+            enriched = index.enrich_rows("invoices_lines", [dict(row)])[0]
+
+            ctx = reference_ctx(snapshot_dir)
+            from_snapshot = ctx.reference_index()
+            self.assertEqual(fetched(ctx), [])
+
+        self.assertEqual(
+            from_snapshot.enrich_rows("invoices_lines", [dict(row)])[0], enriched
+        )
+        self.assertEqual(enriched["AccountID"], "acc-1")
+        self.assertEqual(enriched["AccountName"], "Sales")
+        self.assertEqual(enriched["TaxName"], "GST on Income")
+        self.assertEqual(enriched["TaxRate"], 15.0)
+        self.assertEqual(enriched["ItemName"], "Widget")
+        self.assertEqual(enriched["Tracking"]["TrackingOptionID"], "to-1")
+        self.assertNotIn("TrackingOptionID", row["Tracking"])
+        self.assertEqual(index.enrich_rows("journals_lines", [row]), [row])
+        manual = index.enrich_rows("manual_journals_lines", [dict(row)])[0]
+        self.assertEqual(manual["AccountName"], "Sales")
+
+    def test_schemas_advertise_enriched_fields_only_when_on(self):
+        config = {"enrich_line_items": True}
+        for stream_id in ("invoices_lines", "manual_journals_lines"):
+            plain = load_correct_schema(stream_id)["properties"]
+            enriched = load_correct_schema(stream_id, config)["properties"]
+            self.assertNotIn("AccountName", plain)
+            self.assertIn("AccountName", enriched)
+            self.assertIn("TaxRate", enriched)
+            self.assertIn("TrackingOptionID", enriched["Tracking"]["properties"])
+        invoice = load_correct_schema("invoices_lines", config)["properties"]
+        self.assertIn("ItemName", invoice)
+        manual = load_correct_schema("manual_journals_lines", config)["properties"]
+        self.assertNotIn("ItemName", manual)
+        journal = load_correct_schema("journals_lines", config)
+        self.assertEqual(journal, load_correct_schema("journals_lines"))
+
+    def test_off_unless_configured(self):
+        self.assertIsNone(make_ctx({}, []).reference_index())
+        self.assertIsInstance(ReferenceIndex({}, {}, {}, {}).enrich({}), dict)
@@ -0,0 +1,108 @@
+import os
+import time
+import tempfile
+import unittest
+import requests
+from tap_xero.cache import ResponseCache, CacheMiss
+from tap_xero.client import XeroClient
+
+
+class CountingSession:
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, request):
+        self.sent += 1
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{"Invoices": []}'
+        return resp
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_key_depends_on_request(self):
+        key = ResponseCache.key("t1", "Invoices", {"page": 1}, "2020-01-01")
+        self.assertEqual(
+            key, ResponseCache.key("t1", "Invoices", {"page": 1}, "2020-01-01")
+        )
+        self.assertNotEqual(
+            key, ResponseCache.key("t1", "Invoices", {"page": 2}, "2020-01-01")
+        )
+        self.assertNotEqual(
+            key, ResponseCache.key("t1", "Invoices", {"page": 1}, "2020-01-02")
+        )
+
+    def test_round_trip_and_expiry(self):
+        cache = ResponseCache(self.tmp.name, ttl=60)
+        cache.put("ab12", '{"Invoices": []}')
+        self.assertEqual(cache.get("ab12"), '{"Invoices": []}')
+
+        old = time.time() - 120
+        os.utime(cache._path("ab12"), (old, old))
+        self.assertIsNone(cache.get("ab12"))
+
+    def test_size_eviction_drops_oldest(self):
+        cache = ResponseCache(self.tmp.name, max_bytes=10)
+        cache.put("aa01", "123456")
+        old = time.time() - 30
+        os.utime(cache._path("aa01"), (old, old))
+        cache.put("bb02", "abcdef")
+        self.assertIsNone(cache.get("aa01"))
+        self.assertEqual(cache.get("bb02"), "abcdef")
+
+    def test_writes_beside_other_writers(self):
+        cache = ResponseCache(self.tmp.name)
+        # another process midway through writing the same entry
+        other = cache._path("aa01") + ".tmp"
+        os.makedirs(os.path.dirname(other))
+        with open(other, "w") as f:
+            f.write("partial")
+        cache.put("aa01", "123456")
+        self.assertEqual(cache.get("aa01"), "123456")
+        with open(other) as f:
+            self.assertEqual(f.read(), "partial")
+        self.assertEqual(len(os.listdir(os.path.dirname(other))), 2)
+
+    def test_evicts_entries_another_process_removed_first(self):
+        cache = ResponseCache(self.tmp.name, max_bytes=10, ttl=60)
+        now = time.time()
+        listed = [
+            (cache._path("aa01"), now - 120, 6),
+            (cache._path("bb02"), now - 30, 6),
+            (cache._path("cc03"), now, 6),
+        ]
+        cache._entries = lambda: iter(listed)
+        cache.evict()
+        self.assertEqual(cache._size, 6)
+
+    def test_offline_miss_raises(self):
+        cache = ResponseCache(self.tmp.name, offline=True)
+        with self.assertRaises(CacheMiss):
+            cache.get("cd34")
+
+    def test_size_counts_bytes_once_per_key(self):
+        cache = ResponseCache(self.tmp.name)
+        cache.evict()
+        cache.put("ef56", "\u00e9t\u00e9")
+        cache.put("ef56", "\u00e9t\u00e9")
+        self.assertEqual(cache._size, 5)
+
+    def test_only_resumed_pages_are_served(self):
+        client = XeroClient({"response_cache_dir": self.tmp.name})
+        client.session = CountingSession()
+        client.tenant_id = "t"
+        client.access_token = "token"
+        for _ in range(2):
+            client.fetch_raw("invoices", since="2020-01-01", page=1)
+            client.fetch_raw("currencies")
+        self.assertEqual(client.session.sent, 4)
+
+        client.set_resuming("invoices", True)
+        client.set_resuming("currencies", True)
+        client.fetch_raw("invoices", since="2020-01-01", page=1)
+        client.fetch_raw("currencies")
+        self.assertEqual(client.session.sent, 5)
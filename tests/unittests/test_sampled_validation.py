@@ -0,0 +1,72 @@
+import unittest
+from tap_xero.validation import RecordTransformer
+
+SCHEMA = {
+    "type": ["null", "object"],
+    "properties": {
+        "InvoiceID": {"type": ["string"]},
+        "Total": {"type": ["null", "number"]},
+        "UpdatedDateUTC": {"type": ["null", "string"], "format": "date-time"},
+        "Contact": {
+            "type": ["null", "object"],
+            "properties": {"ContactID": {"type": ["string"]}},
+        },
+        "Payments": {
+            "type": ["null", "array"],
+            "items": {
+                "type": ["null", "object"],
+                "properties": {"Amount": {"type": ["null", "number"]}},
+            },
+        },
+    },
+}
+MDATA = {
+    (): {"selected": True},
+    ("properties", "InvoiceID"): {"inclusion": "automatic"},
+    ("properties", "Total"): {"inclusion": "available"},
+    ("properties", "UpdatedDateUTC"): {"inclusion": "automatic"},
+    ("properties", "Contact"): {"inclusion": "available"},
+    ("properties", "Payments"): {"inclusion": "available", "selected": False},
+}
+
+
+def record(i):
+    return {
+        "InvoiceID": str(i),
+        "Total": 10,
+        "UpdatedDateUTC": "2020-10-28T14:28:53.000000Z",
+        "Contact": {"ContactID": "c", "Name": "not in schema"},
+        "Payments": [{"Amount": 1.5}],
+        "Extra": "not in schema",
+    }
+
+
+class TestSampledValidation(unittest.TestCase):
+    def test_fast_path_matches_full_transform(self):
+        full = RecordTransformer("invoices", SCHEMA, MDATA)
+        sampled = RecordTransformer(
+            "invoices", SCHEMA, MDATA, mode="sampled", full_records=2, sample_every=3
+        )
+        for i in range(10):
+            self.assertEqual(sampled.transform(record(i)), full.transform(record(i)))
+        self.assertTrue(sampled.sampled)
+
+    def test_unusual_values_fall_back_to_full_transform(self):
+        sampled = RecordTransformer(
+            "invoices", SCHEMA, MDATA, mode="sampled", full_records=0, sample_every=100
+        )
+        rec = dict(record(1), Total="1,000.5", UpdatedDateUTC="2020-10-28T14:28:53Z")
+        transformed = sampled.transform(rec)
+        self.assertEqual(transformed["Total"], 1000.5)
+        self.assertEqual(transformed["UpdatedDateUTC"], "2020-10-28T14:28:53.000000Z")
+
+    def test_disagreement_switches_back_to_full_validation(self):
+        sampled = RecordTransformer(
+            "invoices", SCHEMA, MDATA, mode="sampled", full_records=1, sample_every=2
+        )
+        sampled.transform(record(0))
+        self.assertTrue(sampled.sampled)
+        sampled.fast = lambda rec: {}
+        sampled.transform(record(1))
+        sampled.transform(record(2))
+        self.assertFalse(sampled.sampled)
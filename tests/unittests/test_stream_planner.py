@@ -0,0 +1,48 @@
+import unittest
+from types import SimpleNamespace
+from tap_xero.planner import StreamPlanner, _today
+
+
+class FakeStream:
+    def __init__(self, tap_stream_id, calls=1):
+        self.tap_stream_id = tap_stream_id
+        self.calls = calls
+
+    def sync(self, ctx, sub=None):
+        ctx.client.calls += self.calls
+        ctx.records_written += 10
+
+
+def make_ctx(state=None, **config):
+    client = SimpleNamespace(calls=0, bytes_received=0, day_limit_remaining=None)
+    return SimpleNamespace(
+        config=config, state=state or {}, client=client, records_written=0
+    )
+
+
+class TestStreamPlanner(unittest.TestCase):
+    def test_orders_by_priority_keeping_default_order(self):
+        ctx = make_ctx(stream_priorities={"invoices": 10})
+        streams = [FakeStream("journals"), FakeStream("contacts"), FakeStream("invoices")]
+        ordered = StreamPlanner(ctx).order(streams)
+        self.assertEqual(
+            [s.tap_stream_id for s in ordered], ["invoices", "journals", "contacts"]
+        )
+
+    def test_records_stats_and_defers_over_budget(self):
+        ctx = make_ctx()
+        planner = StreamPlanner(ctx)
+        planner.run(FakeStream("journals", calls=40), None)
+        stats = ctx.state["stream_stats"]["journals"]
+        self.assertEqual(stats["calls"], 40)
+        self.assertEqual(stats["records"], 10)
+
+        ctx.client.day_limit_remaining = 30
+        self.assertTrue(planner.should_defer("journals"))
+        self.assertFalse(planner.should_defer("invoices"))
+        self.assertEqual(planner.deferred, ["journals"])
+
+    def test_uses_remaining_quota_saved_today(self):
+        state = {"api_usage": {"date": _today(), "remaining": 5}}
+        planner = StreamPlanner(make_ctx(state, daily_call_reserve=2))
+        self.assertEqual(planner.remaining_calls(), 3)
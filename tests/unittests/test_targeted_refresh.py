@@ -0,0 +1,50 @@
+import json
+import tempfile
+import unittest
+from tap_xero import targeted
+from tap_xero.streams import streams_by_id
+from helpers import make_ctx
+
+
+class TestTargetedRefresh(unittest.TestCase):
+    def test_reads_new_webhook_events_for_tenant(self):
+        inv_1 = {"resourceId": "inv-1", "eventCategory": "INVOICE", "tenantId": "t1"}
+        con_1 = {"resourceId": "con-1", "eventCategory": "CONTACT", "tenantId": "t2"}
+        con_2 = {"resourceId": "con-2", "eventCategory": "CONTACT", "tenantId": "t1"}
+        events = [{"events": [inv_1, con_1]}, inv_1, con_2]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in events))
+            f.write('{"resourceId": "inv-9"')
+            f.flush()
+            ids, offset = targeted.read_webhook_events(f.name, "t1")
+            self.assertEqual(ids, {"invoices": ["inv-1"], "contacts": ["con-2"]})
+
+            ids, _ = targeted.read_webhook_events(f.name, "t1", offset)
+            self.assertEqual(ids, {})
+
+    def test_id_filters(self):
+        self.assertEqual(
+            targeted.id_filter(streams_by_id["invoices"], ["a", "b"]), {"IDs": "a,b"}
+        )
+        self.assertEqual(
+            targeted.id_filter(streams_by_id["bank_transactions"], ["a", "b"]),
+            {"where": 'BankTransactionID==Guid("a") OR BankTransactionID==Guid("b")'},
+        )
+
+    def test_rejects_streams_without_id_lookup(self):
+        with self.assertRaises(Exception):
+            targeted._add_ids({}, "journals", ["a"])
+
+    def test_refresh_requests_pages_of_at_most_100_ids(self):
+        def pages(tap_stream_id, since, params):
+            if params["page"] > 1:
+                return []
+            return [{"InvoiceID": i, "LineItems": []} for i in params["IDs"].split(",")]
+
+        ctx = make_ctx({"refresh_ids_chunk_size": 250}, ["invoices"], pages)
+        ids = [f"inv-{i}" for i in range(250)]
+        targeted.refresh_stream(ctx, streams_by_id["invoices"], None, ids)
+        requests = [(len(p["IDs"].split(",")), p["page"]) for _, p in ctx.requests]
+        self.assertEqual(requests, [(100, 1), (100, 2), (100, 1), (100, 2), (50, 1)])
+        records = [record["InvoiceID"] for record in ctx.sink.records()]
+        self.assertEqual(records, ids)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from singer import utils
+from singer.utils import strftime
+from tap_xero.client import XeroClient
+from tap_xero.streams import streams_by_id
+from tap_xero.telemetry import Telemetry
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_writes_prometheus_textfile(self):
+        client = XeroClient({})
+        client.calls = 3
+        client.day_limit_remaining = 4997
+        client.stream_usage = {"invoices": {"calls": 3, "bytes": 3000}}
+        an_hour_ago = strftime(utils.now() - timedelta(hours=1))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tap_xero.prom")
+            config = {"tenant_id": "t", "metrics_textfile": path}
+            telemetry = Telemetry.from_config(config, client)
+            telemetry.records_written(
+                streams_by_id["invoices"],
+                [{"UpdatedDateUTC": an_hour_ago}, {"UpdatedDateUTC": None}],
+            )
+            telemetry.rate_limited("invoices", 2.5)
+            telemetry.flush()
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+        labels = '{tenant="t",stream="invoices"}'
+        self.assertIn("# TYPE tap_xero_records_total counter", lines)
+        self.assertIn(f"tap_xero_records_total{labels} 2", lines)
+        self.assertIn(f"tap_xero_bytes_total{labels} 3000", lines)
+        self.assertIn(f"tap_xero_rate_limited_seconds_total{labels} 2.5", lines)
+        self.assertIn('tap_xero_api_calls_remaining{tenant="t"} 4997', lines)
+        lag = [l for l in lines if l.startswith("tap_xero_freshness_lag_seconds")]
+        self.assertAlmostEqual(float(lag[0].split()[-1]), 3600, delta=60)
+
+    def test_off_unless_configured(self):
+        self.assertIsNone(Telemetry.from_config({}, XeroClient({})))